@@ -6,6 +6,14 @@ from models.BlackListTokensModel import BlackListTokensModel
 from models.PostModel import PostModel
 from config import app_config
 from models import db, bcrypt
+from commands import register_commands
+from cache import init_caches
+from hashing import password_hasher
+from search import search_index
+from votes import vote_buffer
+from routing import replica_router
+from slow_queries import slow_query_log
+from serializers import FastJSONEncoder
 
 
 def create_app(env_name):
@@ -13,10 +21,27 @@ def create_app(env_name):
     app = Flask(__name__)
 
     app.config.from_object(app_config[env_name])
+    # orjson behind jsonify when installed, the output is unchanged
+    if app.config.get("FAST_JSON_ENCODER"):
+        app.json_encoder = FastJSONEncoder
 
     # initializing bcrypt
     bcrypt.init_app(app)  # add this line
     db.init_app(app)  # add this line
+    init_caches(app)
+    # bcrypt cost and the hashing process pool
+    password_hasher.init_app(app)
+    # full text index of posts and replies, filled by start_background_tasks
+    search_index.init_app(app)
+    # optional write behind buffer for votes
+    vote_buffer.init_app(app)
+    # optional read replica for GET routes
+    replica_router.init_app(app)
+    # logs statements over SLOW_QUERY_MS
+    slow_query_log.init_app(app)
+
+    # management commands, run with `flask <command>`
+    register_commands(app)
 
     return app
 
@@ -0,0 +1,3 @@
+# src/benchmarks/__init__.py
+# Reproducible benchmarks of the API hot paths, run `python -m benchmarks`
+# from the src directory. See benchmarks/__main__.py for the options.
@@ -0,0 +1,142 @@
+# src/benchmarks/__main__.py
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# the benchmark config has to be picked before the app is created
+os.environ["FLASK_ENV"] = "benchmark"
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+from run import app, API_URL
+from models import db
+from benchmarks.generator import SHAPE, generate
+from benchmarks.harness import measure
+from benchmarks.budgets import SHAPES, check_budgets
+from benchmarks.suite import operations
+from tasks import refresh_handle_index, refresh_search_index
+from slow_queries import slow_query_log
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the API hot paths")
+    for key, value in SHAPE.items():
+        parser.add_argument(
+            f"--{key.replace('_', '-')}", type=type(value), default=value
+        )
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--only", help="run the operations containing this text")
+    parser.add_argument(
+        "--no-generate", action="store_true", help="reuse the existing database"
+    )
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--compare", help="show deltas against a results json file")
+    parser.add_argument(
+        "--budgets",
+        action="store_true",
+        help="check the per request query budgets instead, exits 1 on a failure",
+    )
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except Exception:
+        return None
+
+
+def report(results, baseline=None):
+    print(f"{'operation':<34}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'queries':>9}")
+    for name, stats in results.items():
+        line = (
+            f"{name:<34}{stats['p50_ms']:>9.2f}{stats['p90_ms']:>9.2f}"
+            f"{stats['p99_ms']:>9.2f}{stats['queries']:>9.1f}"
+        )
+        previous = (baseline or {}).get(name)
+        if previous:
+            change = (stats["p50_ms"] / previous["p50_ms"] - 1) * 100
+            line += f"  p50 {change:+.0f}%, queries {previous['queries']:.1f}"
+        print(line)
+
+
+def budgets():
+    # each shape regenerates the database, the command line shape is ignored
+    client = app.test_client()
+    failures = []
+    for shape_name, shape in SHAPES.items():
+        with app.app_context():
+            dataset = generate(**shape)
+            refresh_handle_index()
+            refresh_search_index()
+            engine = db.engine
+        print(f"Shape {shape_name}: {dataset}")
+        for name, count, limit, failure in check_budgets(app, client, API_URL, engine):
+            print(f"  {'FAIL' if failure else 'ok':<6}{name:<48}{count:>3} / {limit}")
+            if failure:
+                failures.append(failure)
+
+    for failure in failures:
+        print(f"\n{failure}")
+    return not failures
+
+
+def main():
+    args = parse_args()
+    if args.budgets:
+        sys.exit(0 if budgets() else 1)
+    shape = {key: getattr(args, key) for key in SHAPE}
+
+    with app.app_context():
+        if args.no_generate:
+            dataset = None
+        else:
+            dataset = generate(**shape)
+            print(f"Generated dataset: {dataset}")
+            # the in memory indexes were built from the old tables at startup
+            refresh_handle_index()
+            refresh_search_index()
+        engine = db.engine
+    # only the operations' slow queries are of interest
+    slow_query_log.clear()
+
+    client = app.test_client()
+    results = {}
+    for name, operation in operations(app, client, API_URL):
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(engine, operation, args.iterations)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline)
+    slow_queries = slow_query_log.entries()
+    if slow_queries:
+        print(f"{len(slow_queries)} slow queries, see the log above for plans")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "shape": shape,
+                    "dataset": dataset,
+                    "results": results,
+                    "slow_queries": slow_queries,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
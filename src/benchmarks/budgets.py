@@ -0,0 +1,83 @@
+# src/benchmarks/budgets.py
+from models import db
+from models.PostModel import PostModel, ReplyModel
+from routes.auth import create_token
+from benchmarks.generator import SHAPE
+from benchmarks.harness import QueryBudget, QueryBudgetExceeded
+
+# every budget has to hold on each shape, the threads of the deep one are
+# orders of magnitude bigger so per comment queries show up as failures
+SHAPES = {
+    "flat": {**SHAPE, "users": 30, "posts": 60, "roots": 1, "fanout": 1, "depth": 0},
+    "deep": {**SHAPE, "users": 30, "posts": 60, "roots": 8, "fanout": 4, "depth": 5},
+}
+
+# (method, path, most SQL statements), {post} is the busiest thread,
+# {quiet_post} the quietest and {comment} a root comment of {post}
+BUDGETS = [
+    ("GET", "/posts?limit=50", 3),
+    ("GET", "/posts?sort=hot&limit=50", 3),
+    ("GET", "/posts?cursor=&limit=50", 2),
+    ("GET", "/posts?cursor=&limit=50&count=true", 3),
+    ("GET", "/posts/me", 1),
+    ("GET", "/posts/me?cursor=&limit=50", 1),
+    ("GET", "/post/{post}", 5),
+    ("GET", "/post/{quiet_post}", 5),
+    ("GET", "/post/{post}/comments?limit=50", 5),
+    ("GET", "/comment/{comment}/replies?limit=50", 5),
+    ("GET", "/user/1", 2),
+    ("GET", "/users?limit=50", 1),
+    ("GET", "/search?q=reply+depth&limit=50", 0),
+    ("PUT", "/post/{post}/upvote", 5),
+    ("PUT", "/comment/{comment}/upvote", 6),
+]
+
+
+def targets():
+    # ids filled into the budgeted paths
+    busiest = PostModel.comment_count.desc(), PostModel.id.asc()
+    post_id = db.session.query(PostModel.id).order_by(*busiest).limit(1).scalar()
+    quietest = PostModel.comment_count.asc(), PostModel.id.asc()
+    quiet_post_id = db.session.query(PostModel.id).order_by(*quietest).limit(1).scalar()
+    comment_id = (
+        db.session.query(ReplyModel.id)
+        .filter_by(post_id=post_id, parent_id=None)
+        .order_by(ReplyModel.id.asc())
+        .limit(1)
+        .scalar()
+    )
+    return {"post": post_id, "quiet_post": quiet_post_id, "comment": comment_id}
+
+
+def check_budgets(app, client, url, engine):
+    """
+    Run every budgeted request once to warm the per process caches, then
+    again under a QueryBudget. Returns (name, count, limit, failure) for
+    each budget, failure being None or the QueryBudgetExceeded.
+    """
+    with app.app_context():
+        ids = targets()
+        headers = {"x-access-token": create_token(1)}
+
+    results = []
+    for method, path, limit in BUDGETS:
+        name = f"{method} {path.format(**ids)}"
+
+        def run():
+            response = client.open(
+                url + path.format(**ids), method=method, headers=headers
+            )
+            # streamed bodies run their queries while being read
+            response.get_data()
+            assert response.status_code == 200, (name, response.status_code)
+
+        run()
+        budget = QueryBudget(engine, limit, name)
+        try:
+            with budget:
+                run()
+        except QueryBudgetExceeded as e:
+            results.append((name, budget.count, limit, e))
+        else:
+            results.append((name, budget.count, limit, None))
+    return results
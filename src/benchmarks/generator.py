@@ -0,0 +1,131 @@
+# src/benchmarks/generator.py
+import datetime
+import itertools
+import random
+from models import db
+from models.UserModel import UserModel
+from models.PostModel import PostModel, ReplyModel, COMMENT_POINTS, hot_weight
+from models.UpvoteModel import UpvoteModel, CommentUpvoteModel
+from importer import insert_rows
+
+# all generated rows hang off this time, so datasets are identical per seed
+EPOCH = datetime.datetime(2022, 1, 1)
+PASSWORD = "benchmark"
+
+# default dataset shape, every key can be overridden from the command line
+SHAPE = {
+    "seed": 1,
+    "users": 200,
+    "posts": 1000,
+    "roots": 5,  # root comments per post, at most
+    "fanout": 3,  # replies per comment, at most
+    "depth": 4,  # levels of nesting below the root comments
+    "vote_density": 0.05,  # share of users voting on each post and comment
+}
+
+
+def voters(rng, user_ids, density):
+    k = min(len(user_ids), int(rng.random() * 2 * density * len(user_ids)))
+    return rng.sample(user_ids, k)
+
+
+def generate(**shape):
+    """
+    Recreate the tables and fill them with a synthetic dataset,
+    returns the row counts per table.
+    """
+    shape = {**SHAPE, **shape}
+    rng = random.Random(shape["seed"])
+    clock = (EPOCH + datetime.timedelta(seconds=i) for i in itertools.count())
+
+    db.drop_all()
+    db.create_all()
+
+    # every user shares one hash, bcrypt would dominate the load otherwise
+    password = UserModel().generate_hash(PASSWORD)
+    users = []
+    for i in range(1, shape["users"] + 1):
+        now = next(clock)
+        users.append(
+            {
+                "id": i,
+                "fname": f"First{i}",
+                "lname": f"Last{i}",
+                "handle": f"user{i}",
+                "email": f"user{i}@bench.local",
+                "password": password,
+                "created_at": now,
+                "modified_at": now,
+            }
+        )
+    user_ids = [user["id"] for user in users]
+
+    posts, replies, upvotes, comment_upvotes = [], [], [], []
+    for post_id in range(1, shape["posts"] + 1):
+        now = next(clock)
+        post_voters = voters(rng, user_ids, shape["vote_density"])
+        upvotes.extend({"post_id": post_id, "liked_by": user} for user in post_voters)
+
+        # grow the comment tree breadth first
+        thread, paths = [], {None: ""}
+        level = [None] * rng.randint(0, shape["roots"])
+        for depth in range(shape["depth"] + 1):
+            next_level = []
+            for parent_id in level:
+                reply_id = len(replies) + len(thread) + 1
+                paths[reply_id] = ReplyModel.make_path(paths[parent_id], reply_id)
+                reply_voters = voters(rng, user_ids, shape["vote_density"])
+                comment_upvotes.extend(
+                    {"comment_id": reply_id, "liked_by": user} for user in reply_voters
+                )
+                stamp = next(clock)
+                thread.append(
+                    {
+                        "id": reply_id,
+                        "text": f"Reply {reply_id} at depth {depth}",
+                        "created_on": stamp,
+                        "modified_at": stamp,
+                        "parent_id": parent_id,
+                        "path": paths[reply_id],
+                        "depth": depth,
+                        "upvote_count": len(reply_voters),
+                        "user_id": rng.choice(user_ids),
+                        "post_id": post_id,
+                    }
+                )
+                if depth < shape["depth"]:
+                    next_level.extend([reply_id] * rng.randint(0, shape["fanout"]))
+            level = next_level
+        replies.extend(thread)
+
+        posts.append(
+            {
+                "id": post_id,
+                "title": f"Benchmark post {post_id}",
+                "text": "Lorem ipsum dolor sit amet, consectetur adipiscing elit.",
+                "created_on": now,
+                "modified_at": now,
+                "isClosed": False,
+                "upvote_count": len(post_voters),
+                "comment_count": len(thread),
+                "hot_weight": hot_weight(now, now),
+                "hot_score": (len(post_voters) + COMMENT_POINTS * len(thread) + 1)
+                * hot_weight(now, now),
+                "user_id": rng.choice(user_ids),
+            }
+        )
+
+    insert_rows(UserModel, users)
+    insert_rows(PostModel, posts)
+    insert_rows(ReplyModel, replies)
+    insert_rows(UpvoteModel, upvotes)
+    insert_rows(CommentUpvoteModel, comment_upvotes)
+    db.session.commit()
+
+    return {
+        "users": len(users),
+        "posts": len(posts),
+        "replies": len(replies),
+        "upvotes": len(upvotes),
+        "comment_upvotes": len(comment_upvotes),
+    }
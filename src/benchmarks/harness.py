@@ -0,0 +1,91 @@
+# src/benchmarks/harness.py
+import time
+from sqlalchemy import event
+
+
+class QueryCounter(object):
+    """
+    Context manager recording every SQL statement run on an engine
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self.record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget(QueryCounter):
+    """
+    QueryCounter raising QueryBudgetExceeded, with the statements that ran,
+    when the block runs more than `limit` statements
+    """
+
+    def __init__(self, engine, limit, name="block"):
+        super().__init__(engine)
+        self.limit = limit
+        self.name = name
+
+    def __exit__(self, exc_type, *exc):
+        super().__exit__(exc_type, *exc)
+        if exc_type is None and self.count > self.limit:
+            raise QueryBudgetExceeded(self.report())
+
+    def report(self):
+        lines = [f"{self.name} ran {self.count} statements, budget {self.limit}:"]
+        for i, statement in enumerate(self.statements, 1):
+            lines.append(f"  {i}. {' '.join(statement.split())}")
+        return "\n".join(lines)
+
+
+def percentile(values, pct):
+    # nearest rank percentile of an already sorted list
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def measure(engine, operation, iterations, warmup=3):
+    """
+    Run `operation` repeatedly, returns latency percentiles in
+    milliseconds and the SQL statements issued per call.
+    """
+    for _ in range(warmup):
+        operation()
+
+    latencies, queries = [], []
+    for _ in range(iterations):
+        with QueryCounter(engine) as counter:
+            start = time.perf_counter()
+            operation()
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count)
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": sum(latencies) / len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1],
+        "queries": sum(queries) / len(queries),
+        "max_queries": max(queries),
+    }
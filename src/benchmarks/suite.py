@@ -0,0 +1,54 @@
+# src/benchmarks/suite.py
+from models import db
+from models.PostModel import PostModel, ReplyModel
+from routes.auth import create_token
+
+
+def operations(app, client, url):
+    """
+    The benchmarked operations as (name, callable) pairs. Requests go
+    through the Flask test client so decorators and serialization count.
+    """
+    with app.app_context():
+        # the busiest thread is the interesting one for the comment tree
+        post_id = (
+            db.session.query(PostModel.id)
+            .order_by(PostModel.comment_count.desc(), PostModel.id.asc())
+            .limit(1)
+            .scalar()
+        )
+        comment_id = (
+            db.session.query(ReplyModel.id)
+            .filter_by(post_id=post_id)
+            .order_by(ReplyModel.id.asc())
+            .limit(1)
+            .scalar()
+        )
+        posts = PostModel.query.count()
+        headers = {"x-access-token": create_token(1)}
+
+    def request(method, path):
+        def run():
+            response = client.open(url + path, method=method, headers=headers)
+            assert response.status_code == 200, (path, response.status_code)
+            return response
+
+        return run
+
+    def get_comments():
+        with app.app_context():
+            ReplyModel.get_comments(post_id)
+
+    deep_page = max(1, posts // 20)
+    return [
+        ("ReplyModel.get_comments", get_comments),
+        ("GET /post/<id>", request("GET", f"/post/{post_id}")),
+        ("GET /posts first page", request("GET", "/posts?start=1&limit=20")),
+        ("GET /posts deep page", request("GET", f"/posts?start={deep_page}&limit=20")),
+        ("GET /posts cursor", request("GET", "/posts?cursor=&limit=20")),
+        ("GET /posts hot", request("GET", "/posts?sort=hot&cursor=&limit=20")),
+        ("GET /search", request("GET", "/search?q=reply+depth&limit=20")),
+        ("token_required GET /user/<id>", request("GET", "/user/1")),
+        ("PUT /post/<id>/upvote", request("PUT", f"/post/{post_id}/upvote")),
+        ("PUT /comment/<id>/upvote", request("PUT", f"/comment/{comment_id}/upvote")),
+    ]
@@ -0,0 +1,356 @@
+# src/cache.py
+import bisect
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+from models.BlackListTokensModel import BlackListTokensModel
+
+
+class TTLCache(object):
+    """
+    Thread safe, size bounded LRU cache whose entries expire after a ttl
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clear()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                # expired
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._store(key, time.monotonic() + ttl, value)
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._remove(key)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+    # storage hooks, always called with the lock held
+    def _store(self, key, expires_at, value):
+        self._data[key] = (expires_at, value)
+
+    def _remove(self, key):
+        return self._data.pop(key, None)
+
+    def _evict(self):
+        # evict the least recently used entries
+        while len(self._data) > self.maxsize:
+            self._remove(next(iter(self._data)))
+
+
+class PayloadCache(TTLCache):
+    """
+    Cache of rendered response bodies, bounded by entry count and bytes.
+
+    get_or_build() is single flight: concurrent misses on the same key wait
+    for one build instead of each rebuilding the payload.
+
+    Tuple keys are grouped by their first item, so every variant of a
+    resource can be invalidated at once, e.g. (post_id, max_depth).
+    """
+
+    def __init__(self, maxsize=256, ttl=30, max_bytes=16 * 1024 * 1024):
+        super().__init__(maxsize, ttl)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._flights = {}  # key -> in flight build
+        self._groups = {}  # group -> keys
+
+    def configure(self, maxsize, ttl, max_bytes):
+        self.max_bytes = max_bytes
+        super().configure(maxsize, ttl)
+
+    def set(self, key, value, ttl=None):
+        # a payload that can never fit is not worth evicting everything for
+        if len(value) > self.max_bytes:
+            return
+        super().set(key, value, ttl)
+
+    def invalidate(self, group):
+        with self._lock:
+            for key in list(self._groups.get(group, ())):
+                self._remove(key)
+            # a build that started before this write must not be cached
+            for key, flight in self._flights.items():
+                if PayloadCache.group(key) == group:
+                    flight.stale = True
+
+    @staticmethod
+    def group(key):
+        return key[0] if isinstance(key, tuple) else key
+
+    def get_or_build(self, key, build):
+        payload = self.get(key)
+        if payload is not None:
+            return payload
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            # the leader raised, build on our own rather than guess
+            if flight.failed:
+                return build()
+            return flight.payload
+
+        try:
+            flight.payload = build()
+        except Exception:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+        if flight.payload is not None and not flight.stale:
+            self.set(key, flight.payload)
+        return flight.payload
+
+    def stats(self):
+        return {**super().stats(), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+    def _store(self, key, expires_at, value):
+        super()._store(key, expires_at, value)
+        self.bytes += len(value)
+        self._groups.setdefault(PayloadCache.group(key), set()).add(key)
+
+    def _remove(self, key):
+        entry = super()._remove(key)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+            group = PayloadCache.group(key)
+            keys = self._groups[group]
+            keys.discard(key)
+            if not keys:
+                del self._groups[group]
+        return entry
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.maxsize or self.bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._data)))
+
+
+class _Flight(object):
+    # a payload build other threads can wait on
+    def __init__(self):
+        self.done = threading.Event()
+        self.payload = None
+        self.stale = False
+        self.failed = False
+
+
+class BlacklistCache(object):
+    """
+    Per process view of the token blacklist.
+
+    Revoked tokens and known good tokens are both cached until the token
+    expires. New blacklist rows are pulled from the database by their
+    blacklisted_on watermark at most once per staleness window, so every
+    worker converges on a logout within BLACKLIST_CACHE_STALENESS seconds.
+    """
+
+    def __init__(self):
+        self.revoked = None
+        self.valid = None
+        self.staleness = 0
+        self.watermark = None
+        self.refreshed_at = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        size = app.config.get("BLACKLIST_CACHE_SIZE", 10000)
+        self.staleness = app.config.get("BLACKLIST_CACHE_STALENESS", 5)
+        self.revoked = TTLCache(size)
+        self.valid = TTLCache(size)
+        self.watermark = datetime.datetime.utcnow()
+        self.refreshed_at = time.monotonic()
+
+    def is_blacklisted(self, token):
+        self.refresh()
+
+        if self.revoked.get(token):
+            return True
+        if self.valid.get(token):
+            return False
+
+        # unknown token, ask the database once and remember the answer
+        blacklisted = BlackListTokensModel.is_token_blacklisted(token)
+        if blacklisted:
+            self.revoked.set(token, True, BlacklistCache.expires_in(token))
+        else:
+            self.valid.set(token, True, BlacklistCache.expires_in(token))
+        return blacklisted
+
+    def revoke(self, token):
+        # blacklist a token locally, other workers pick it up on refresh
+        self.valid.pop(token)
+        self.revoked.set(token, True, BlacklistCache.expires_in(token))
+
+    def refresh(self, force=False):
+        if not force and time.monotonic() - self.refreshed_at < self.staleness:
+            return
+
+        with self._lock:
+            if not force and time.monotonic() - self.refreshed_at < self.staleness:
+                return
+            self.refreshed_at = time.monotonic()
+
+            # look back one window to tolerate clock skew between workers
+            since = self.watermark - datetime.timedelta(seconds=self.staleness)
+            rows = BlackListTokensModel.get_blacklisted_since(since)
+            for token, blacklisted_on in rows:
+                self.valid.pop(token)
+                self.revoked.set(token, True, BlacklistCache.expires_in(token))
+                if blacklisted_on and blacklisted_on > self.watermark:
+                    self.watermark = blacklisted_on
+
+    @staticmethod
+    def expires_in(token):
+        # seconds until the token expires, the signature is checked elsewhere
+        try:
+            data = jwt.decode(token, options={"verify_signature": False})
+            return data["exp"] - time.time()
+        except Exception:
+            return 0
+
+
+class HandleIndex(object):
+    """
+    Sorted in memory index of user handles for prefix autocomplete.
+    Kept current by the writes in this process and rebuilt on startup and
+    every HANDLE_INDEX_REFRESH_INTERVAL seconds to pick up other workers.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._keys = []  # lowercased handles, sorted
+        self._entries = []  # (handle, id) in the same order as _keys
+        self._handles = {}  # id -> handle
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        # rows of (id, handle)
+        entries = sorted(
+            ((handle.lower(), handle, id) for id, handle in rows),
+            key=lambda entry: (entry[0], entry[2]),
+        )
+        with self._lock:
+            self._keys = [key for key, _, _ in entries]
+            self._entries = [(handle, id) for _, handle, id in entries]
+            self._handles = {id: handle for _, handle, id in entries}
+            self.loaded = True
+
+    def add(self, id, handle):
+        with self._lock:
+            self._remove(id)
+            i = bisect.bisect_right(self._keys, handle.lower())
+            self._keys.insert(i, handle.lower())
+            self._entries.insert(i, (handle, id))
+            self._handles[id] = handle
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def complete(self, prefix, limit=10):
+        # [(handle, id)] of handles starting with prefix, case insensitive
+        prefix = prefix.lower()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, prefix)
+            matches = []
+            while (
+                i < len(self._keys)
+                and len(matches) < limit
+                and self._keys[i].startswith(prefix)
+            ):
+                matches.append(self._entries[i])
+                i += 1
+            return matches
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _remove(self, id):
+        handle = self._handles.pop(id, None)
+        if handle is None:
+            return
+        i = bisect.bisect_left(self._keys, handle.lower())
+        while self._entries[i][1] != id:
+            i += 1
+        del self._keys[i]
+        del self._entries[i]
+
+
+blacklist_cache = BlacklistCache()
+# detached users by id, for the auth decorators
+user_cache = TTLCache()
+# rendered GET /post/<id> bodies by (post id, max_depth, max_children)
+post_cache = PayloadCache()
+# user handles for @mention autocomplete
+handle_index = HandleIndex()
+
+
+def init_caches(app):
+    blacklist_cache.init_app(app)
+    user_cache.configure(
+        app.config.get("USER_CACHE_SIZE", 1024), app.config.get("USER_CACHE_TTL", 60)
+    )
+    post_cache.configure(
+        app.config.get("POST_CACHE_SIZE", 256),
+        app.config.get("POST_CACHE_TTL", 30),
+        app.config.get("POST_CACHE_MAX_BYTES", 16 * 1024 * 1024),
+    )
@@ -0,0 +1,97 @@
+# src/commands.py
+import click
+from flask.cli import with_appcontext
+from models import db
+from models.PostModel import PostModel, ReplyModel
+from models.UpvoteModel import UpvoteModel, CommentUpvoteModel, delete_duplicates
+from tasks import sweep_blacklist as sweep_blacklist_task
+from tasks import decay_hot_scores as decay_hot_scores_task
+from importer import Importer
+
+
+@click.command("reconcile-counters")
+@with_appcontext
+def reconcile_counters():
+    """Recompute drifted upvote and comment counters."""
+    posts, comments = PostModel.reconcile_counters()
+    print(f"Reconciled counters: {posts} post(s), {comments} comment(s)")
+
+
+@click.command("backfill-reply-paths")
+@click.option("--batch-size", type=int, default=1000, help="posts per transaction")
+@with_appcontext
+def backfill_reply_paths(batch_size):
+    """Set the materialized path of replies written before paths existed."""
+    updated = ReplyModel.backfill_paths(batch_size)
+    print(f"Backfilled {updated} reply path(s)")
+
+
+@click.command("dedupe-votes")
+@click.option("--batch-size", type=int, default=1000, help="rows per delete")
+@with_appcontext
+def dedupe_votes(batch_size):
+    """Delete duplicate votes and add the one vote per user unique indexes."""
+    posts = delete_duplicates(UpvoteModel, UpvoteModel.post_id, batch_size)
+    comments = delete_duplicates(
+        CommentUpvoteModel, CommentUpvoteModel.comment_id, batch_size
+    )
+    print(f"Deleted {posts} duplicate post vote(s), {comments} comment vote(s)")
+
+    for model in (UpvoteModel, CommentUpvoteModel):
+        for index in model.__table__.indexes:
+            if index.unique:
+                index.create(bind=db.engine, checkfirst=True)
+
+    # the duplicates were counted too
+    PostModel.reconcile_counters()
+    print("Added unique vote indexes and reconciled counters")
+
+
+@click.command("decay-hot-scores")
+@click.option("--all", "everything", is_flag=True, help="every post, not the window")
+@click.option("--batch-size", type=int, default=1000, help="posts per transaction")
+@with_appcontext
+def decay_hot_scores(everything, batch_size):
+    """Recompute the hot feed scores of recent posts, or of every post."""
+    if everything:
+        updated = PostModel.decay_hot_scores(batch_size=batch_size)
+    else:
+        updated = decay_hot_scores_task()
+    print(f"Recomputed {updated} hot score(s)")
+
+
+@click.command("sweep-blacklist")
+@with_appcontext
+def sweep_blacklist():
+    """Delete expired blacklisted tokens."""
+    deleted = sweep_blacklist_task()
+    print(f"Deleted {deleted} expired blacklisted token(s)")
+
+
+@click.command("import-data")
+@click.option("--users", type=click.Path(exists=True), help="users file")
+@click.option("--posts", type=click.Path(exists=True), help="posts file")
+@click.option("--replies", type=click.Path(exists=True), help="replies file")
+@click.option("--votes", type=click.Path(exists=True), help="post upvotes file")
+@click.option(
+    "--comment-votes", type=click.Path(exists=True), help="comment upvotes file"
+)
+@click.option("--workers", type=int, default=None, help="password hashing processes")
+@with_appcontext
+def import_data(users, posts, replies, votes, comment_votes, workers):
+    """Bulk import NDJSON or CSV files of users, posts, replies and votes."""
+    stats = Importer(workers).run(users, posts, replies, votes, comment_votes)
+    for name, stat in stats.items():
+        print(
+            f"Imported {stat['rows']} {name} in {stat['seconds']:.2f}s "
+            f"({stat['rows_per_second']:.0f} rows/s)"
+        )
+
+
+def register_commands(app):
+    app.cli.add_command(reconcile_counters)
+    app.cli.add_command(backfill_reply_paths)
+    app.cli.add_command(dedupe_votes)
+    app.cli.add_command(decay_hot_scores)
+    app.cli.add_command(sweep_blacklist)
+    app.cli.add_command(import_data)
@@ -4,30 +4,142 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-class Development(object):
+def replica_binds(name):
+    # read replica from an environment variable, GET routes read from it
+    url = os.environ.get(name)
+    return {"replica": url} if url else None
+
+
+class Config(object):
     """
-    Development environment configuration
+    Settings shared by every environment, which override what differs
     """
 
-    DEBUG = True
+    DEBUG = False
     TESTING = False
     JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
-    SQLALCHEMY_DATABASE_URI = os.environ.get("MYSQL_DB")
+    JWT_EXPIRY_MINUTES = 30
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # connections per process, SQLite ignores the queue settings
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": 5,
+        "max_overflow": 5,
+        "pool_timeout": 30,  # seconds
+        "pool_recycle": 1800,  # seconds, below the server's wait_timeout
+        "pool_pre_ping": True,
+    }
+    SQLALCHEMY_BINDS = None
+    # a user reads from the primary for this long after a write
+    REPLICA_PIN_SECONDS = 5
+    # token blacklist cache, workers see a logout within the staleness window
+    BLACKLIST_CACHE_SIZE = 10000
+    BLACKLIST_CACHE_STALENESS = 5  # seconds
+    # authenticated users cached per process
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 60  # seconds
+    # rendered post details, a ttl of 0 disables the cache
+    POST_CACHE_SIZE = 256
+    POST_CACHE_TTL = 30  # seconds
+    POST_CACHE_MAX_BYTES = 16 * 1024 * 1024
+    # expired blacklist rows are swept in the background, 0 disables it
+    BLACKLIST_SWEEP_INTERVAL = 300  # seconds
+    BLACKLIST_SWEEP_BATCH_SIZE = 1000
+    # handle autocomplete index, reloaded to see other workers' writes,
+    # 0 disables the reload
+    HANDLE_INDEX_REFRESH_INTERVAL = 60  # seconds
+    # full text search, "fts5" (SQLite) or "memory", rebuilt every
+    # interval, 0 disables the rebuild
+    SEARCH_BACKEND = "fts5"
+    SEARCH_INDEX_REFRESH_INTERVAL = 300  # seconds
+    # write behind vote buffer, flushed every interval or once this many
+    # votes wait, 0 writes every vote straight away
+    VOTE_BUFFER_INTERVAL = 0  # seconds
+    VOTE_BUFFER_MAX_PENDING = 1000
+    # hot feed scores decay for posts younger than the window, 0 disables it
+    HOT_SCORE_DECAY_INTERVAL = 600  # seconds
+    HOT_SCORE_WINDOW_DAYS = 7
+    # bcrypt cost, older hashes are upgraded on login
+    PASSWORD_ROUNDS = 10
+    # hashing processes, 0 hashes on the request thread
+    PASSWORD_HASH_WORKERS = 2
+    # queued or running hashes per process before answering 503
+    PASSWORD_HASH_QUEUE_SIZE = 8
+    PASSWORD_HASH_TIMEOUT = 10  # seconds
+    # statements slower than this are logged, 0 disables the log
+    SLOW_QUERY_MS = 100
+    # also log the database's plan of slow selects, runs a second query
+    SLOW_QUERY_EXPLAIN = True
+    SLOW_QUERY_LOG_SIZE = 100  # recent slow queries kept in memory
+    # encode responses with orjson when it is installed, same bytes out
+    FAST_JSON_ENCODER = True
+    # per route latency and SQL counters at /metrics
+    METRICS_ENABLED = True
+
+
+class Development(Config):
+    """
+    Development environment configuration
+    """
+
+    DEBUG = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get("MYSQL_DB")
+    SQLALCHEMY_BINDS = replica_binds("MYSQL_REPLICA_DB")
 
 
-class Production(object):
+class Production(Config):
     """
     Production environment configurations
     """
 
-    DEBUG = False
-    TESTING = False
-    JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
     SQLALCHEMY_DATABASE_URI = os.environ.get("PROD_DB_URL")
+    # connections per process, size them so that workers * (pool_size +
+    # max_overflow) stays below the server's max_connections
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        **Config.SQLALCHEMY_ENGINE_OPTIONS,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+    }
+    SQLALCHEMY_BINDS = replica_binds("PROD_REPLICA_DB_URL")
+    BLACKLIST_CACHE_SIZE = 100000
+    USER_CACHE_SIZE = 10000
+    POST_CACHE_SIZE = 2048
+    POST_CACHE_MAX_BYTES = 128 * 1024 * 1024
+    BLACKLIST_SWEEP_BATCH_SIZE = 5000
+    SEARCH_BACKEND = "memory"
+    PASSWORD_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = os.cpu_count()
+    PASSWORD_HASH_QUEUE_SIZE = 4 * os.cpu_count()
+    SLOW_QUERY_MS = 500
+    SLOW_QUERY_EXPLAIN = False
+
+
+class Benchmark(Config):
+    """
+    Benchmark configuration, a local SQLite database with the payload
+    caches and background jobs off so every request exercises the real
+    code paths
+    """
+
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get("BENCH_DB", "sqlite:///benchmark.db")
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        **Config.SQLALCHEMY_ENGINE_OPTIONS,
+        "max_overflow": 10,
+        "pool_pre_ping": False,
+    }
+    SQLALCHEMY_BINDS = replica_binds("BENCH_REPLICA_DB")
+    POST_CACHE_TTL = 0  # seconds
+    BLACKLIST_SWEEP_INTERVAL = 0  # seconds
+    HANDLE_INDEX_REFRESH_INTERVAL = 0  # seconds
+    SEARCH_INDEX_REFRESH_INTERVAL = 0  # seconds
+    HOT_SCORE_DECAY_INTERVAL = 0  # seconds
+    SLOW_QUERY_MS = 25
+    # off so timings compare with runs from before /metrics existed
+    METRICS_ENABLED = False
 
 
 app_config = {
     "development": Development,
     "production": Production,
+    "benchmark": Benchmark,
 }
@@ -0,0 +1,25 @@
+# src/cursors.py
+import base64
+import json
+
+
+def encode_cursor(after_id):
+    # opaque cursor continuing after a row id, empty for the start
+    if not after_id:
+        return ""
+    data = json.dumps({"after": after_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    # the row id to continue after, None for the start, raises ValueError
+    # for a cursor we did not make
+    if not cursor:
+        return None
+
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        data = base64.urlsafe_b64decode((cursor + padding).encode("ascii"))
+        return int(json.loads(data)["after"])
+    except Exception:
+        raise ValueError("Invalid cursor")
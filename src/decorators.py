@@ -2,10 +2,11 @@ from dotenv import load_dotenv
 
 load_dotenv()
 from functools import wraps
-from flask import request, jsonify, session
+from flask import request, jsonify, session, make_response, current_app, g
+import datetime, hashlib
 import jwt, os
 from models.UserModel import UserModel
-from models.BlackListTokensModel import BlackListTokensModel
+from cache import blacklist_cache
 
 # decorator for verifying the JWT in Request Header
 def token_required(f):
@@ -19,11 +20,8 @@ def token_required(f):
         if not token:
             return jsonify({"message": "Token is missing"}), 401
 
-        # drop old blacklisted tokens
-        BlackListTokensModel.delete_old_records()
-
         # if token is blacklisted
-        if BlackListTokensModel.is_token_blacklisted(token):
+        if blacklist_cache.is_blacklisted(token):
             return jsonify({"message": "Token is blacklisted or invalid"}), 401
 
         try:
@@ -31,7 +29,9 @@ def token_required(f):
             data = jwt.decode(
                 token, os.environ.get("JWT_SECRET_KEY"), algorithms="HS256"
             )
-            current_user = UserModel.query.filter_by(id=data["id"]).first()
+            # pins the reads of a writer, see routing.ReplicaRouter
+            g.user_id = data["id"]
+            current_user = UserModel.get_cached(data["id"])
 
             if current_user == None:
                 return (
@@ -62,7 +62,7 @@ def session_required(f):
             return jsonify({"message": "Token is missing"}), 401
 
         # if token is blacklisted
-        if BlackListTokensModel.is_token_blacklisted(token):
+        if blacklist_cache.is_blacklisted(token):
             return jsonify({"message": "Token is blacklisted or invalid"}), 401
 
         try:
@@ -70,8 +70,10 @@ def session_required(f):
             data = jwt.decode(
                 token, os.environ.get("JWT_SECRET_KEY"), algorithms="HS256"
             )
+            # pins the reads of a writer, see routing.ReplicaRouter
+            g.user_id = data["id"]
 
-            current_user = UserModel.query.filter_by(id=data["id"]).first()
+            current_user = UserModel.get_cached(data["id"])
 
             if current_user == None:
                 return (
@@ -86,3 +88,52 @@ def session_required(f):
         return f(current_user, *args, **kwargs)
 
     return decorated
+
+
+# decorator answering conditional GETs with 304 Not Modified
+# `version` gets the route arguments and returns the parts the payload
+# depends on plus its last modified time, or None to skip the check
+def conditional(version):
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            validators = version(*args, **kwargs)
+            if validators is None:
+                return f(*args, **kwargs)
+
+            parts, last_modified = validators
+            # the route can key its caches on the version it answers for
+            g.version = parts
+            key = repr((request.full_path, parts)).encode("utf-8")
+            etag = hashlib.sha1(key).hexdigest()
+            if last_modified is not None:
+                # http dates have no sub second precision
+                last_modified = last_modified.replace(
+                    microsecond=0, tzinfo=datetime.timezone.utc
+                )
+
+            # If-None-Match wins over If-Modified-Since when both are sent
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = (
+                    request.if_modified_since is not None
+                    and last_modified is not None
+                    and request.if_modified_since >= last_modified
+                )
+
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+
+        return decorated
+
+    return decorator
@@ -0,0 +1,127 @@
+# src/hashing.py
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt as bcrypt_lib
+from flask import jsonify
+
+# default bcrypt cost, PASSWORD_ROUNDS in the config overrides it
+DEFAULT_ROUNDS = 10
+
+
+class HasherBusy(Exception):
+    # every hashing slot is taken or the job timed out, answered with 503
+    pass
+
+
+def hash_password(password, rounds):
+    # same format as flask_bcrypt, runs in the worker processes
+    salt = bcrypt_lib.gensalt(rounds)
+    return bcrypt_lib.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+
+
+def check_password(password_hash, password):
+    return bcrypt_lib.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+
+
+def hash_rounds(password_hash):
+    # the cost is the second field of a bcrypt hash, $2b$10$...
+    try:
+        return int(password_hash.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher(object):
+    """
+    Runs bcrypt in a process pool so a burst of logins cannot tie up every
+    request thread on CPU. At most `queue_size` hashes are queued or running
+    per process, past that calls fail fast with HasherBusy.
+    """
+
+    def __init__(self):
+        self.rounds = DEFAULT_ROUNDS
+        self.workers = None
+        self.queue_size = 0
+        self.timeout = None
+        self.rejected = 0
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rounds = app.config.get("PASSWORD_ROUNDS", DEFAULT_ROUNDS)
+        # 0 workers hashes on the calling thread
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", os.cpu_count())
+        self.queue_size = app.config.get(
+            "PASSWORD_HASH_QUEUE_SIZE", 4 * (self.workers or 1)
+        )
+        self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT", 10)  # seconds
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        app.register_error_handler(HasherBusy, busy)
+
+    def hash(self, password):
+        return self.submit(hash_password, password, self.rounds)
+
+    def check(self, password_hash, password):
+        return self.submit(check_password, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # only ever raise the cost, a cheaper environment must not weaken hashes
+        rounds = hash_rounds(password_hash)
+        return rounds is not None and rounds < self.rounds
+
+    def submit(self, fn, *args):
+        if self._slots is None:
+            # outside an app, e.g. scripts, hash inline
+            return fn(*args)
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                slots.release()
+
+        try:
+            future = self.pool().submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        # the slot is held until the job ends, not until we stop waiting,
+        # so jobs left running by a timeout still count against the queue
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # overloaded, not a wrong password
+            raise HasherBusy()
+
+    def pool(self):
+        # created lazily, and again after a fork, pools do not survive one
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def stats(self):
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "rejected": self.rejected,
+        }
+
+
+def busy(error):
+    response = jsonify({"ERROR": "Too many requests, try again later"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,290 @@
+# src/importer.py
+import csv
+import datetime
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from models import db
+from models.UserModel import UserModel
+from models.PostModel import PostModel, ReplyModel, hot_weight
+from models.UpvoteModel import UpvoteModel, CommentUpvoteModel
+from hashing import hash_password, password_hasher
+
+BATCH_SIZE = 5000
+
+
+def insert_rows(model, rows):
+    # executemany in batches, committing is left to the caller
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(model.__table__.insert(), rows[i : i + BATCH_SIZE])
+
+
+def read_records(path):
+    # NDJSON by default, CSV for .csv files
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                yield {
+                    key: (value if value != "" else None) for key, value in row.items()
+                }
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def to_datetime(value):
+    if value is None:
+        return datetime.datetime.utcnow()
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value)
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def hash_passwords(passwords, workers=None):
+    if not passwords:
+        return []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(
+            pool.map(
+                hash_password,
+                passwords,
+                itertools.repeat(password_hasher.rounds),
+                chunksize=16,
+            )
+        )
+
+
+def existing_paths(reply_ids):
+    # (path, depth) by id for replies already in the database
+    reply_ids = [reply_id for reply_id in reply_ids if reply_id is not None]
+    paths = {}
+    for i in range(0, len(reply_ids), BATCH_SIZE):
+        rows = db.session.query(ReplyModel.id, ReplyModel.path, ReplyModel.depth)
+        rows = rows.filter(ReplyModel.id.in_(reply_ids[i : i + BATCH_SIZE]))
+        paths.update((id, (path, depth)) for id, path, depth in rows)
+    return paths
+
+
+def unique_votes(rows):
+    # one vote per user and target, as the unique indexes require
+    return list({tuple(row.values()): row for row in rows}.values())
+
+
+class IdMap(object):
+    """
+    Hands out table ids for imported rows and maps the ids used in the
+    import files onto them. Ids that are not part of the import are taken
+    to be rows already in the database.
+    """
+
+    def __init__(self, model):
+        self.next_id = (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+        self.ids = {}
+
+    def allocate(self, source_id):
+        new_id = self.next_id
+        self.next_id += 1
+        if source_id is not None:
+            self.ids[str(source_id)] = new_id
+        return new_id
+
+    def resolve(self, source_id):
+        if source_id is None:
+            return None
+        if str(source_id) in self.ids:
+            return self.ids[str(source_id)]
+        return int(source_id)
+
+
+def thread_order(records):
+    # order replies so every parent is inserted before its children
+    def key(value):
+        return None if value is None else str(value)
+
+    parents = {
+        key(r["id"]): key(r.get("parent_id"))
+        for r in records
+        if r.get("id") is not None
+    }
+    depths = {}
+
+    def depth_of(reply):
+        # -1 for no reply, or a reply that is already in the database
+        chain = []
+        while reply in parents and reply not in depths:
+            if reply in chain:
+                raise ValueError(f"Reply {reply} is part of a parent_id cycle")
+            chain.append(reply)
+            reply = parents[reply]
+        depth = depths.get(reply, -1)
+        for reply in reversed(chain):
+            depth += 1
+            depths[reply] = depth
+        return depth
+
+    return sorted(records, key=lambda r: depth_of(key(r.get("parent_id"))) + 1)
+
+
+class Importer(object):
+    """
+    Bulk loads users, posts, replies and votes, one transaction per table
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.users = IdMap(UserModel)
+        self.posts = IdMap(PostModel)
+        self.replies = IdMap(ReplyModel)
+        self.stats = {}
+
+    def timed(self, name, load, path):
+        start = time.perf_counter()
+        count = load(list(read_records(path)))
+        db.session.commit()
+        elapsed = time.perf_counter() - start
+        self.stats[name] = {
+            "rows": count,
+            "seconds": elapsed,
+            "rows_per_second": count / elapsed if elapsed else float(count),
+        }
+
+    def load_users(self, records):
+        # hash plain passwords in a process pool, pre hashed ones are kept
+        plain = [r["password"] for r in records if not r.get("password_hash")]
+        hashes = iter(hash_passwords(plain, self.workers))
+
+        rows = []
+        for record in records:
+            created_at = to_datetime(record.get("created_at"))
+            rows.append(
+                {
+                    "id": self.users.allocate(record.get("id")),
+                    "fname": record["fname"],
+                    "lname": record["lname"],
+                    "handle": record["handle"],
+                    "email": record["email"],
+                    "password": record.get("password_hash") or next(hashes),
+                    "created_at": created_at,
+                    "modified_at": to_datetime(record.get("modified_at", created_at)),
+                }
+            )
+        insert_rows(UserModel, rows)
+        return len(rows)
+
+    def load_posts(self, records):
+        rows = []
+        for record in records:
+            created_on = to_datetime(record.get("created_on"))
+            rows.append(
+                {
+                    "id": self.posts.allocate(record.get("id")),
+                    "title": record["title"],
+                    "text": record["text"],
+                    "created_on": created_on,
+                    "modified_at": created_on,
+                    "isClosed": to_bool(record.get("isClosed", False)),
+                    "upvote_count": 0,
+                    "comment_count": 0,
+                    # scores are refreshed with the counters after the votes
+                    "hot_weight": hot_weight(created_on),
+                    "hot_score": hot_weight(created_on),
+                    "user_id": self.users.resolve(record["user_id"]),
+                }
+            )
+        insert_rows(PostModel, rows)
+        return len(rows)
+
+    def load_replies(self, records):
+        records = thread_order(records)
+        # materialized paths of replies already in the database
+        imported = {str(r["id"]) for r in records if r.get("id") is not None}
+        paths = existing_paths(
+            {
+                self.replies.resolve(r["parent_id"])
+                for r in records
+                if r.get("parent_id") is not None
+                and str(r["parent_id"]) not in imported
+            }
+        )
+
+        rows = []
+        for record in records:
+            created_on = to_datetime(record.get("created_on"))
+            reply_id = self.replies.allocate(record.get("id"))
+            parent_id = self.replies.resolve(record.get("parent_id"))
+            # parents come first, so imported parents always have a path,
+            # existing ones may still be waiting for backfill-reply-paths
+            if parent_id is None:
+                path, depth = ReplyModel.make_path("", reply_id), 0
+            elif paths.get(parent_id, (None, 0))[0] is not None:
+                parent_path, parent_depth = paths[parent_id]
+                path = ReplyModel.make_path(parent_path, reply_id)
+                depth = parent_depth + 1
+            else:
+                path, depth = None, 0
+            paths[reply_id] = (path, depth)
+            rows.append(
+                {
+                    "id": reply_id,
+                    "text": record["text"],
+                    "created_on": created_on,
+                    "modified_at": created_on,
+                    "parent_id": parent_id,
+                    "path": path,
+                    "depth": depth,
+                    "upvote_count": 0,
+                    "user_id": self.users.resolve(record["user_id"]),
+                    "post_id": self.posts.resolve(record["post_id"]),
+                }
+            )
+        insert_rows(ReplyModel, rows)
+        return len(rows)
+
+    def load_votes(self, records):
+        rows = unique_votes(
+            {
+                "post_id": self.posts.resolve(record["post_id"]),
+                "liked_by": self.users.resolve(record["liked_by"]),
+            }
+            for record in records
+        )
+        insert_rows(UpvoteModel, rows)
+        return len(rows)
+
+    def load_comment_votes(self, records):
+        rows = unique_votes(
+            {
+                "comment_id": self.replies.resolve(record["comment_id"]),
+                "liked_by": self.users.resolve(record["liked_by"]),
+            }
+            for record in records
+        )
+        insert_rows(CommentUpvoteModel, rows)
+        return len(rows)
+
+    def run(self, users=None, posts=None, replies=None, votes=None, comment_votes=None):
+        # parents before children so every reference can be resolved
+        if users:
+            self.timed("users", self.load_users, users)
+        if posts:
+            self.timed("posts", self.load_posts, posts)
+        if replies:
+            self.timed("replies", self.load_replies, replies)
+        if votes:
+            self.timed("votes", self.load_votes, votes)
+        if comment_votes:
+            self.timed("comment_votes", self.load_comment_votes, comment_votes)
+
+        # the denormalized counters are rebuilt once at the end
+        PostModel.reconcile_counters()
+        return self.stats
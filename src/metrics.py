@@ -0,0 +1,180 @@
+# src/metrics.py
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+# request latency histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+
+def escape(value):
+    # label values are quoted, escape backslashes, quotes and newlines
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels(**pairs):
+    return ",".join(f'{name}="{escape(value)}"' for name, value in pairs.items())
+
+
+class Metrics(object):
+    """
+    Per route request and SQL accounting, served in the Prometheus text
+    format at /metrics. Requests are labelled with their url rule rather
+    than the raw path, so the number of series stays bounded. Counters are
+    per process, every worker reports its own.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # (method, route) -> [bucket counts, +Inf count, seconds]
+        self._latency = {}
+        # (method, route, status) -> requests
+        self._statuses = {}
+        # (method, route) -> [statements, seconds], route None outside requests
+        self._sql = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("METRICS_ENABLED", True)
+        if not self.enabled:
+            return
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        # streamed responses are only done once the context is torn down
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.view)
+
+        with app.app_context():
+            binds = [None] + list(app.config.get("SQLALCHEMY_BINDS") or ())
+            for bind in binds:
+                self.instrument(db.get_engine(app, bind=bind))
+
+    def instrument(self, engine):
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+        event.listen(engine, "after_cursor_execute", self.after_execute)
+
+    def before_execute(self, conn, cursor, statement, parameters, context, many):
+        # a connection runs one statement at a time
+        conn.info["metrics_started"] = time.perf_counter()
+
+    def after_execute(self, conn, cursor, statement, parameters, context, many):
+        started = conn.info.pop("metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        if has_request_context() and "metrics_started" in g:
+            g.metrics_sql[0] += 1
+            g.metrics_sql[1] += elapsed
+            return
+        # background tasks and commands
+        with self._lock:
+            totals = self._sql.setdefault((None, None), [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+
+    def before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql = [0, 0.0]
+
+    def after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def teardown_request(self, exc):
+        if "metrics_started" not in g:
+            return
+        elapsed = time.perf_counter() - g.metrics_started
+        method = request.method if request.method in METHODS else "OTHER"
+        # unmatched paths share one label
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        status = g.get("metrics_status", 500)
+        statements, sql_seconds = g.metrics_sql
+        g.pop("metrics_started")
+        self.record(method, route, status, elapsed, statements, sql_seconds)
+
+    def record(self, method, route, status, seconds, statements=0, sql_seconds=0.0):
+        with self._lock:
+            latency = self._latency.get((method, route))
+            if latency is None:
+                latency = self._latency[(method, route)] = [[0] * len(BUCKETS), 0, 0.0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    latency[0][i] += 1
+            latency[1] += 1
+            latency[2] += seconds
+
+            key = (method, route, status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+            totals = self._sql.setdefault((method, route), [0, 0.0])
+            totals[0] += statements
+            totals[1] += sql_seconds
+
+    def render(self):
+        with self._lock:
+            latency = sorted(self._latency.items())
+            statuses = sorted(self._statuses.items())
+            sql = sorted(
+                self._sql.items(), key=lambda item: tuple(v or "" for v in item[0])
+            )
+
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), (buckets, count, seconds) in latency:
+            for bound, value in zip(BUCKETS, buckets):
+                pairs = labels(method=method, route=route, le=bound)
+                lines.append(f"http_request_duration_seconds_bucket{{{pairs}}} {value}")
+            pairs = labels(method=method, route=route, le="+Inf")
+            lines.append(f"http_request_duration_seconds_bucket{{{pairs}}} {count}")
+            pairs = labels(method=method, route=route)
+            lines.append(f"http_request_duration_seconds_sum{{{pairs}}} {seconds}")
+            lines.append(f"http_request_duration_seconds_count{{{pairs}}} {count}")
+
+        lines += [
+            "# HELP http_requests_total Requests by route and status code.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in statuses:
+            pairs = labels(method=method, route=route, status=status)
+            lines.append(f"http_requests_total{{{pairs}}} {count}")
+
+        lines += [
+            "# HELP db_statements_total SQL statements by route.",
+            "# TYPE db_statements_total counter",
+        ]
+        lines += self._sql_lines("db_statements_total", sql, 0)
+        lines += [
+            "# HELP db_statement_seconds_total Time spent in SQL by route.",
+            "# TYPE db_statement_seconds_total counter",
+        ]
+        lines += self._sql_lines("db_statement_seconds_total", sql, 1)
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        return (
+            self.render(),
+            200,
+            {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    @staticmethod
+    def _sql_lines(name, sql, field):
+        lines = []
+        for (method, route), totals in sql:
+            if route is None:
+                # statements run outside a request
+                pairs = labels(method="", route="background")
+            else:
+                pairs = labels(method=method, route=route)
+            lines.append(f"{name}{{{pairs}}} {totals[field]}")
+        return lines
+
+
+metrics = Metrics()
@@ -3,8 +3,10 @@ from marshmallow import fields, Schema
 from . import db
 class BlackListTokensModel(db.Model):
     id = db.Column(db.Integer(), primary_key=True)
-    token = db.Column(db.String(255), nullable=False)
-    blacklisted_on = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    token = db.Column(db.String(255), nullable=False, index=True)
+    blacklisted_on = db.Column(
+        db.DateTime, default=datetime.datetime.utcnow, index=True
+    )
 
     def __repr__(self):
         return f"BlackListToken<id={self.id}, token={self.token}, blacklisted_on={self.blacklisted_on}>"
@@ -17,15 +19,41 @@ class BlackListTokensModel(db.Model):
     def is_token_blacklisted(cls, token):
         return True if cls.query.filter_by(token=token).first() != None else False
 
+    @classmethod
+    def get_blacklisted_since(cls, since):
+        # (token, blacklisted_on) rows added after the given time
+        return (
+            db.session.query(cls.token, cls.blacklisted_on)
+            .filter(cls.blacklisted_on >= since)
+            .all()
+        )
+
     def add(self):
         db.session.add(self)
         db.session.commit()
 
-    def delete_old_records():
-        # delete all records older than 24 hours
-        expiry = datetime.datetime.utcnow() - datetime.timedelta(minutes=30)
-        db.session.query(BlackListTokensModel).filter(BlackListTokensModel.blacklisted_on < expiry).delete()
-        db.session.commit()
+    @classmethod
+    def delete_old_records(cls, retention, batch_size=1000):
+        # delete records older than the retention period in chunks,
+        # so a large backlog never holds the table in one long delete
+        expiry = datetime.datetime.utcnow() - retention
+        deleted = 0
+        while True:
+            ids = [
+                row.id
+                for row in db.session.query(cls.id)
+                .filter(cls.blacklisted_on < expiry)
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+
+            cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+            if len(ids) < batch_size:
+                break
+        return deleted
 
 class BlackListTokensSchema(Schema):
     id = fields.Integer()
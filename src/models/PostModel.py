@@ -1,18 +1,63 @@
+import base64
 import datetime
+import json
 from marshmallow import fields, Schema
-from models.UserModel import UserModel, UserSchema
+from models.UserModel import UserModel
 from models.UpvoteModel import UpvoteModel
 from models.UpvoteModel import CommentUpvoteModel
+from models.VersionModel import VersionModel
 from . import db
+from search import search_index
+from votes import vote_buffer
+from serializers import compile_schema
+from cursors import encode_cursor, decode_cursor
+
+# hot ranking, (points + 1) / (age in hours + 2) ^ HOT_GRAVITY where a
+# reply is worth COMMENT_POINTS votes
+HOT_GRAVITY = 1.8
+COMMENT_POINTS = 2
+
+
+def hot_weight(created_on, now=None):
+    now = now or datetime.datetime.utcnow()
+    hours = max((now - created_on).total_seconds() / 3600, 0)
+    return 1 / (hours + 2) ** HOT_GRAVITY
 
 
 class PostModel(db.Model):
+    # (sort key, id) indexes back the cursor pagination and ranked feeds
+    __table_args__ = (
+        db.Index("ix_post_model_created_on_id", "created_on", "id"),
+        db.Index("ix_post_model_user_id_created_on_id", "user_id", "created_on", "id"),
+        db.Index("ix_post_model_hot_score_id", "hot_score", "id"),
+        db.Index("ix_post_model_upvote_count_id", "upvote_count", "id"),
+    )
+
     id = db.Column(db.Integer(), primary_key=True)
     text = db.Column(db.String(255), nullable=False)
     title = db.Column(db.String(255), nullable=False)
     created_on = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # bumped on every change to the post or its thread, drives the ETags
+    modified_at = db.Column(
+        db.DateTime,
+        default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+        index=True,
+    )
     isClosed = db.Column(db.Boolean, default=False)
 
+    # denormalized counters, kept in step by the vote and reply models
+    upvote_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # hot_score = points * hot_weight, the weight decays in the background
+    # and the score follows the counters
+    hot_weight = db.Column(
+        db.Float, nullable=False, default=lambda: hot_weight(datetime.datetime.utcnow())
+    )
+    hot_score = db.Column(
+        db.Float, nullable=False, default=lambda: hot_weight(datetime.datetime.utcnow())
+    )
+
     user_id = db.Column(
         db.Integer,
         db.ForeignKey(
@@ -28,7 +73,7 @@ class PostModel(db.Model):
         return f"Post<id={self.id}>"
 
     @staticmethod
-    def get_post(post_id, delete=False):
+    def get_post(post_id, delete=False, max_depth=None, max_children=None):
         # get post by id with user info
         post = PostModel.query.filter_by(id=post_id).first()
         if not post:
@@ -38,15 +83,17 @@ class PostModel(db.Model):
             return post
 
         user = UserModel.query.filter_by(id=post.user_id).first()
-        meta = PostModel.get_post_meta(user, post_id, True)
-        post = PostSchema().dump(post)
+        meta = PostModel.get_post_meta(user, post, True, max_depth, max_children)
+        post = dump_post(post)
         return {**post, **meta}
 
     # get user info
     @staticmethod
-    def get_post_meta(user, post_id, verbose=False):
-        user = UserSchema().dump(user)
-        author = {"handle": user.get("handle"), "id": user.get("id")}
+    def get_post_meta(user, post, verbose=False, max_depth=None, max_children=None):
+        author = {
+            "handle": user.handle if user else None,
+            "id": user.id if user else None,
+        }
 
         # if getting all posts, there is no need
         # to get the meta data for the post
@@ -54,26 +101,213 @@ class PostModel(db.Model):
         if not verbose:
             return {
                 "author": author,
-                "upvote_count": UpvoteModel.get_upvote_count(post_id) or 0,
-                "comment_count": ReplyModel.get_reply_count(post_id) or 0,
+                "upvote_count": post.upvote_count + vote_buffer.delta("post", post.id),
+                "comment_count": post.comment_count,
             }
 
         # if it is a verbose request, get the replies and upvotes
         # because they are needed for the post to be viewed
-        upvotes = UpvoteModel.get_upvote_count(post_id)  # get upvotes
+        upvotes = post.upvote_count + vote_buffer.delta("post", post.id)
         # upvotes = UpvoteModel.get_upvotes(post_id)  # get upvotes
-        comments = ReplyModel.get_comments(post_id)  # get replies
+        comments = ReplyModel.get_comments(post.id, max_depth)  # get replies
+        meta = {"author": author, "upvotes": upvotes, "comments": comments}
+
+        # large threads can be cut down, the rest is paged in on demand
+        if max_children is not None and len(comments) > max_children:
+            shown = comments[:max_children]
+            meta["comments"] = shown
+            meta["more_comments"] = len(comments) - len(shown)
+            meta["comments_cursor"] = encode_cursor(shown[-1]["id"] if shown else None)
+        ReplyModel.truncate_tree(meta["comments"], max_depth, max_children)
+        if max_depth is not None:
+            ReplyModel.mark_frontier(meta["comments"], max_depth)
+
+        return meta
+
+    # get the listing meta data for a page of posts at once
+    @staticmethod
+    def get_posts_meta(posts):
+        meta = {}
+        for post in posts:
+            meta[post.id] = {
+                "author": {"handle": post.user.handle, "id": post.user.id},
+                "upvote_count": post.upvote_count + vote_buffer.delta("post", post.id),
+                "comment_count": post.comment_count,
+            }
+        return meta
 
-        return {"author": author, "upvotes": upvotes, "comments": comments}
+    @staticmethod
+    def update_counter(post_id, column, delta):
+        # bump a counter column in the current transaction
+        PostModel.query.filter_by(id=post_id).update(
+            {column: column + delta}, synchronize_session=False
+        )
+
+    @staticmethod
+    def refresh_hot_scores(post_ids=None):
+        # follow a counter change in the current transaction, every post
+        # when post_ids is None. modified_at is kept, the body is unchanged
+        query = PostModel.query
+        if post_ids is not None:
+            query = query.filter(PostModel.id.in_(post_ids))
+        points = PostModel.upvote_count + COMMENT_POINTS * PostModel.comment_count + 1
+        query.update(
+            {
+                PostModel.hot_score: points * PostModel.hot_weight,
+                PostModel.modified_at: PostModel.modified_at,
+            },
+            synchronize_session=False,
+        )
 
     @staticmethod
-    def paginate_posts(page, limit):
-        # join by user_id to get users and paginate
+    def decay_hot_scores(since=None, batch_size=1000):
+        """
+        Recompute hot_weight and hot_score of the posts created after
+        `since`, or of every post. Returns the number of posts updated.
+        """
+        now = datetime.datetime.utcnow()
+        query = db.session.query(PostModel.id, PostModel.created_on)
+        if since is not None:
+            query = query.filter(PostModel.created_on >= since)
+        statement = (
+            PostModel.__table__.update()
+            .where(PostModel.__table__.c.id == db.bindparam("post_id"))
+            .values(
+                hot_weight=db.bindparam("weight"),
+                hot_score=(
+                    PostModel.upvote_count
+                    + COMMENT_POINTS * PostModel.comment_count
+                    + 1
+                )
+                * db.bindparam("weight"),
+                modified_at=PostModel.modified_at,
+            )
+        )
+
+        posts = query.order_by(PostModel.id.asc()).all()
+        for i in range(0, len(posts), batch_size):
+            params = [
+                {"post_id": post_id, "weight": hot_weight(created_on, now)}
+                for post_id, created_on in posts[i : i + batch_size]
+            ]
+            db.session.execute(statement, params)
+            db.session.commit()
+        return len(posts)
+
+    # (post modified_at, author modified_at) of a post, None if missing
+    @staticmethod
+    def get_post_version(post_id):
         return (
-            PostModel.query.join(UserModel, PostModel.user_id == UserModel.id)
-            .order_by(PostModel.created_on.asc())
-            .paginate(page, limit, False)
+            db.session.query(PostModel.modified_at, UserModel.modified_at)
+            .join(PostModel.user)
+            .filter(PostModel.id == post_id)
+            .first()
+        )
+
+    # (last post id, last post change, last user change, deletes, last
+    # delete) of all posts, every part is an index lookup
+    @staticmethod
+    def get_posts_version():
+        return db.session.query(
+            db.select(db.func.max(PostModel.id)).scalar_subquery(),
+            db.select(db.func.max(PostModel.modified_at)).scalar_subquery(),
+            db.select(db.func.max(UserModel.modified_at)).scalar_subquery(),
+            VersionModel.current("posts_deleted"),
+            VersionModel.changed("posts_deleted"),
+        ).one()
+
+    @staticmethod
+    def reconcile_counters():
+        # recompute every drifted post and comment counter in bulk,
+        # returns the number of rows that were fixed
+        upvotes = (
+            db.select(db.func.count(UpvoteModel.id))
+            .where(UpvoteModel.post_id == PostModel.id)
+            .scalar_subquery()
+        )
+        replies = (
+            db.select(db.func.count(ReplyModel.id))
+            .where(ReplyModel.post_id == PostModel.id)
+            .scalar_subquery()
+        )
+        comment_upvotes = (
+            db.select(db.func.count(CommentUpvoteModel.id))
+            .where(CommentUpvoteModel.comment_id == ReplyModel.id)
+            .scalar_subquery()
+        )
+
+        posts = PostModel.query.filter(
+            db.or_(
+                PostModel.upvote_count != upvotes,
+                PostModel.comment_count != replies,
+            )
+        ).update(
+            {
+                PostModel.upvote_count: upvotes,
+                PostModel.comment_count: replies,
+            },
+            synchronize_session=False,
+        )
+        comments = ReplyModel.query.filter(
+            ReplyModel.upvote_count != comment_upvotes
+        ).update(
+            {ReplyModel.upvote_count: comment_upvotes},
+            synchronize_session=False,
         )
+        PostModel.refresh_hot_scores()
+        db.session.commit()
+        return posts, comments
+
+    @staticmethod
+    def paginate_posts(page, limit, sort=None):
+        # join by user_id to get users and paginate,
+        # loading the author with the same query
+        query = PostModel.query.join(PostModel.user).options(
+            db.contains_eager(PostModel.user)
+        )
+        if sort is None:
+            query = query.order_by(PostModel.created_on.asc())
+        else:
+            column = PostModel.sort_column(sort)
+            query = query.order_by(column.desc(), PostModel.id.desc())
+        return query.paginate(page, limit, False)
+
+    # cursor pagination of all posts, oldest first or ranked by sort
+    @staticmethod
+    def keyset_posts(cursor, limit, count=False, sort=None):
+        query = PostModel.query.join(PostModel.user).options(
+            db.contains_eager(PostModel.user)
+        )
+        if sort is None:
+            return KeysetPagination(query, cursor, limit, count=count)
+        return KeysetPagination(
+            query,
+            cursor,
+            limit,
+            descending=True,
+            count=count,
+            column=PostModel.sort_column(sort),
+        )
+
+    @staticmethod
+    def sort_column(sort):
+        # the indexed column behind each ranked feed, newest or best first
+        columns = {
+            "new": PostModel.created_on,
+            "hot": PostModel.hot_score,
+            "top": PostModel.upvote_count,
+        }
+        if sort not in columns:
+            raise ValueError(f"Unknown sort: {sort}")
+        return columns[sort]
+
+    # cursor pagination of a users posts, newest first
+    @staticmethod
+    def keyset_user_posts(user_id, cursor, limit, count=False):
+        query = PostModel.query.filter_by(user_id=user_id).options(
+            db.joinedload(PostModel.user)
+        )
+        return KeysetPagination(query, cursor, limit, descending=True, count=count)
 
     # get a users posts
     @staticmethod
@@ -92,21 +326,42 @@ class PostModel(db.Model):
     def add(self):
         db.session.add(self)
         db.session.commit()
+        search_index.add_post(self)
 
     def delete(self):
         db.session.delete(self)
+        # listings have no row left to show the delete
+        VersionModel.bump("posts_deleted")
         db.session.commit()
+        search_index.remove_post(self.id)
 
     def close(self):
         self.isClosed = True
         db.session.commit()
+        search_index.add_post(self)
 
 
 class ReplyModel(db.Model):
+    # subtrees and depth first thread order are range scans over the path
+    __table_args__ = (db.Index("ix_reply_model_post_id_path", "post_id", "path"),)
+
+    # fixed width base36 id segments, so paths sort like the ids do
+    PATH_SEGMENT = 6
+    MAX_DEPTH = 84  # deepest reply whose path still fits the column
+
     id = db.Column(db.Integer(), primary_key=True)
     text = db.Column(db.String(255), nullable=False)
     created_on = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    parent_id = db.Column(db.Integer, nullable=True, default=None)
+    modified_at = db.Column(
+        db.DateTime,
+        default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+    )
+    parent_id = db.Column(db.Integer, nullable=True, default=None, index=True)
+    # materialized path, the ids from the root comment down to this reply
+    path = db.Column(db.String(510), nullable=True)
+    depth = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    upvote_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     user_id = db.Column(
         db.Integer,
@@ -127,7 +382,78 @@ class ReplyModel(db.Model):
 
     def add(self):
         db.session.add(self)
+        PostModel.update_counter(self.post_id, PostModel.comment_count, 1)
+        PostModel.refresh_hot_scores([self.post_id])
+        # the path ends with our own id, so it is set once the row has one
+        db.session.flush()
+        parent = ReplyModel.query.get(self.parent_id) if self.parent_id else None
+        self.set_path(parent)
         db.session.commit()
+        search_index.add_reply(self)
+
+    def set_path(self, parent):
+        if parent is None:
+            self.path = ReplyModel.make_path("", self.id)
+            self.depth = 0
+        elif parent.path is not None:
+            self.path = ReplyModel.make_path(parent.path, self.id)
+            self.depth = parent.depth + 1
+        # else the parent predates paths and the backfill fills both in
+
+    @staticmethod
+    def make_path(parent_path, reply_id):
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+        segment = ""
+        while reply_id:
+            reply_id, digit = divmod(reply_id, 36)
+            segment = digits[digit] + segment
+        return (parent_path or "") + segment.rjust(ReplyModel.PATH_SEGMENT, "0")
+
+    @staticmethod
+    def backfill_paths(batch_size=1000):
+        # set path and depth on replies written before paths existed,
+        # a post at a time since threads never cross posts
+        post_ids = [
+            row.post_id
+            for row in db.session.query(ReplyModel.post_id)
+            .filter(ReplyModel.path.is_(None))
+            .distinct()
+        ]
+        statement = (
+            ReplyModel.__table__.update()
+            .where(ReplyModel.__table__.c.id == db.bindparam("reply_id"))
+            .values(path=db.bindparam("path"), depth=db.bindparam("depth"))
+        )
+
+        updated = 0
+        for i in range(0, len(post_ids), batch_size):
+            rows = (
+                db.session.query(
+                    ReplyModel.id, ReplyModel.parent_id, ReplyModel.post_id
+                )
+                .filter(ReplyModel.post_id.in_(post_ids[i : i + batch_size]))
+                .order_by(ReplyModel.id.asc())
+                .all()
+            )
+            # parents are always older than their replies
+            paths, params = {}, []
+            for reply_id, parent_id, _ in rows:
+                parent = paths.get(parent_id)
+                if parent is None:
+                    # root comment, or a reply whose parent was deleted
+                    paths[reply_id] = (ReplyModel.make_path("", reply_id), 0)
+                else:
+                    paths[reply_id] = (
+                        ReplyModel.make_path(parent[0], reply_id),
+                        parent[1] + 1,
+                    )
+                path, depth = paths[reply_id]
+                params.append({"reply_id": reply_id, "path": path, "depth": depth})
+            if params:
+                db.session.execute(statement, params)
+            db.session.commit()
+            updated += len(params)
+        return updated
 
     def delete(self):
         # update comment to [deleted]
@@ -136,63 +462,218 @@ class ReplyModel(db.Model):
         # db.session.commit()
 
         db.session.delete(self)
+        PostModel.update_counter(self.post_id, PostModel.comment_count, -1)
+        PostModel.refresh_hot_scores([self.post_id])
         db.session.commit()
+        search_index.remove_reply(self.id)
 
-    def get_comments(post_id):
-        # get replies and filter by parent_id
-        comments = ReplyModel.query.filter_by(post_id=post_id).all()
-        root_comments = {}
+    def get_comments(post_id, max_depth=None):
+        # build the comment tree for a post, down to max_depth levels
+        return ReplyModel.build_comment_tree(post_id, max_depth)
 
+    @staticmethod
+    def build_comment_tree(post_id, max_depth=None):
+        # load every reply and every comment upvote of the post up front,
+        # then link the nodes by parent_id in a single pass. Path order is
+        # thread order and a range scan over the (post_id, path) index
+        # plain rows of the serialized columns, no ORM objects to build
+        query = db.session.query(*REPLY_COLUMNS).filter(ReplyModel.post_id == post_id)
+        if max_depth is not None:
+            # replies below the cut are counted, not loaded. Rows not
+            # backfilled yet have depth 0 and are all loaded
+            query = query.filter(ReplyModel.depth <= max_depth)
+        comments = query.order_by(ReplyModel.path.asc(), ReplyModel.id.asc()).all()
+        likes = CommentUpvoteModel.get_post_comment_upvotes(post_id)
+        vote_buffer.apply_likes("comment", likes, [c.id for c in comments])
+
+        nodes = {}
+        for comment in comments:
+            node = nodes[comment.id] = dump_reply(comment)
+            node["likes"] = likes.get(comment.id, [])
+
+        root_comments = []
         for comment in comments:
-            likes = CommentUpvoteModel.get_upvotes(comment.id)
+            node = nodes[comment.id]
             if comment.parent_id is None:
-                root_comments[comment.id] = {
-                    **ReplySchema().dump(comment),
-                    **{"likes": likes},
-                }
-                root_comments[comment.id]["replies"] = []
-            elif comment.parent_id:
-                if comment.parent_id in root_comments:
-                    root_comments[comment.parent_id]["replies"].append(
-                        {**ReplySchema().dump(comment), **{"likes": likes}}
-                    )
-                else:
-                    print(f"parent_id {comment.parent_id} not found")
-                    ReplyModel.recursive_sub_comment(comment, root_comments)
+                node.setdefault("replies", [])
+                root_comments.append(node)
+            elif comment.parent_id in nodes:
+                nodes[comment.parent_id].setdefault("replies", []).append(node)
+            # replies whose parent was deleted are unreachable and dropped
+
+        return root_comments
 
-        comments = []
-        for comment in root_comments.values():
-            comments.append(comment)
+    @staticmethod
+    def truncate_tree(comments, max_depth=None, max_children=None):
+        # cut a comment tree down to max_depth levels of replies and
+        # max_children replies per comment, cut comments get a cursor
+        # to page in the rest from GET /comment/<id>/replies
+        stack = [(comment, 0) for comment in comments]
+        while stack:
+            comment, depth = stack.pop()
+            replies = comment.get("replies")
+            if not replies:
+                continue
+
+            if max_depth is not None and depth >= max_depth:
+                shown = []
+            elif max_children is not None:
+                shown = replies[:max_children]
+            else:
+                shown = replies
+
+            if len(shown) < len(replies):
+                ReplyModel.mark_truncated(comment, shown, len(replies) - len(shown))
+            comment["replies"] = shown
+            stack.extend((reply, depth + 1) for reply in shown)
         return comments
 
     @staticmethod
-    def recursive_sub_comment(comment, comments_dict):
-        for reply in comments_dict:
-            try:
-                sub = comments_dict[reply]["replies"]
-            except TypeError:
-                sub = comments_dict["replies"]
-
-            for sub_comment in sub:
-                if sub_comment.get("replies"):
-                    ReplyModel.recursive_sub_comment(comment, sub_comment)
-                else:
-                    if sub_comment["id"] == comment.parent_id:
-                        print(sub_comment["id"])
-                        likes = CommentUpvoteModel.get_upvotes(sub_comment["id"])
-                        if sub_comment.get("replies") is None:
-                            print(sub_comment["id"])
-                            sub_comment["replies"] = []
-                            sub_comment["likes"] = likes
-
-                        sub_comment["replies"].append(
-                            {**ReplySchema().dump(comment), **{"likes": likes}}
-                        )
-                        break
+    def mark_frontier(comments, max_depth):
+        # comments at max_depth whose replies were left out of the query
+        # get the same marker truncate_tree gives the ones it cut
+        level = comments
+        for _ in range(max_depth):
+            level = [reply for comment in level for reply in comment.get("replies", [])]
+        frontier = {
+            comment["id"]: comment for comment in level if "more_replies" not in comment
+        }
+        for reply_id, count in ReplyModel.count_children(list(frontier)).items():
+            frontier[reply_id]["replies"] = []
+            ReplyModel.mark_truncated(frontier[reply_id], [], count)
+
+    @staticmethod
+    def mark_truncated(comment, shown, remaining):
+        comment["more_replies"] = remaining
+        comment["replies_cursor"] = encode_cursor(shown[-1]["id"] if shown else None)
 
     def get_replies(parent_id):
         replies = ReplyModel.query.filter_by(parent_id=parent_id).all()
-        return ReplySchema().dump(replies, many=True)
+        return [dump_reply(reply) for reply in replies]
+
+    @staticmethod
+    def count_children(parent_ids):
+        # map parent_id -> number of direct replies
+        if not parent_ids:
+            return {}
+        counts = (
+            db.session.query(ReplyModel.parent_id, db.func.count(ReplyModel.id))
+            .filter(ReplyModel.parent_id.in_(parent_ids))
+            .group_by(ReplyModel.parent_id)
+            .all()
+        )
+        return dict(counts)
+
+    @staticmethod
+    def get_subtrees(post_id, first, last, max_depth=None):
+        # every reply below a run of sibling comments, depth first,
+        # in one range scan over the (post_id, path) index
+        query = ReplyModel.query.filter(
+            ReplyModel.post_id == post_id,
+            ReplyModel.path > first.path,
+            ReplyModel.path < last.path + "~",
+            ReplyModel.depth > first.depth,
+        )
+        if max_depth is not None:
+            query = query.filter(ReplyModel.depth <= max_depth)
+        return query.order_by(ReplyModel.path.asc()).all()
+
+    @staticmethod
+    def get_subtrees_by_parent(top, levels):
+        # replies below comments written before paths existed, one query
+        # per level, parents come before their replies as with get_subtrees
+        replies, parent_ids = [], [reply.id for reply in top]
+        for _ in range(levels):
+            if not parent_ids:
+                break
+            level = (
+                ReplyModel.query.filter(ReplyModel.parent_id.in_(parent_ids))
+                .order_by(ReplyModel.id.asc())
+                .all()
+            )
+            replies += level
+            parent_ids = [reply.id for reply in level]
+        return replies
+
+    @staticmethod
+    def get_reply_page(post_id, parent, cursor, limit, max_depth, max_children=None):
+        """
+        A page of replies to the parent comment (root comments of the post
+        when it is None) with their subtrees down to max_depth levels.
+        Raises ValueError for a bad cursor.
+        """
+        after = decode_cursor(cursor)
+        parent_id = parent.id if parent else None
+        top = (
+            ReplyModel.query.filter_by(post_id=post_id, parent_id=parent_id)
+            .filter(ReplyModel.id > (after or 0))
+            .order_by(ReplyModel.id.asc())
+            .limit(limit + 1)
+            .all()
+        )
+        has_next = len(top) > limit
+        top = top[:limit]
+
+        replies = []
+        if top and max_depth > 0:
+            if any(reply.path is None for reply in top):
+                # not backfilled yet, see backfill-reply-paths
+                replies = ReplyModel.get_subtrees_by_parent(top, max_depth)
+            else:
+                # siblings are adjacent in path order, so one scan covers them all
+                depth = top[0].depth + max_depth
+                replies = ReplyModel.get_subtrees(post_id, top[0], top[-1], depth)
+
+        nodes, depths = {}, {}
+        for reply in top:
+            nodes[reply.id] = dump_reply(reply)
+            depths[reply.id] = 0
+        for reply in replies:
+            if reply.parent_id not in nodes:
+                continue
+            nodes[reply.id] = dump_reply(reply)
+            depths[reply.id] = depths[reply.parent_id] + 1
+            nodes[reply.parent_id].setdefault("replies", []).append(nodes[reply.id])
+
+        likes = CommentUpvoteModel.get_comment_upvotes(list(nodes))
+        vote_buffer.apply_likes("comment", likes, list(nodes))
+        for node in nodes.values():
+            node["likes"] = likes.get(node["id"], [])
+            if node["parent_id"] is None:
+                node.setdefault("replies", [])
+
+        items = [nodes[reply.id] for reply in top]
+        ReplyModel.truncate_tree(items, max_depth, max_children)
+        # the deepest level loaded may have replies of its own
+        frontier = [id for id, depth in depths.items() if depth == max_depth]
+        for reply_id, count in ReplyModel.count_children(frontier).items():
+            ReplyModel.mark_truncated(nodes[reply_id], [], count)
+
+        return {
+            "items": items,
+            "has_next": has_next,
+            "next_cursor": (encode_cursor(top[-1].id) if has_next else None),
+        }
+
+    @staticmethod
+    def update_counter(reply_id, column, delta):
+        # bump a counter column in the current transaction
+        ReplyModel.query.filter_by(id=reply_id).update(
+            {column: column + delta}, synchronize_session=False
+        )
+
+    @staticmethod
+    def touch_post(reply_id):
+        # the post payload embeds its replies, so a reply change is a post change
+        post_id = (
+            db.select(ReplyModel.post_id)
+            .where(ReplyModel.id == reply_id)
+            .scalar_subquery()
+        )
+        PostModel.query.filter(PostModel.id == post_id).update(
+            {PostModel.modified_at: datetime.datetime.utcnow()},
+            synchronize_session=False,
+        )
 
     def get_reply_count(post_id):
         return ReplyModel.query.filter_by(post_id=post_id).count()
@@ -221,8 +702,111 @@ class ReplySchema(Schema):
     parent_id = fields.Integer()
 
 
+# compiled once, the hot loops call these instead of a schema per item
+dump_post = compile_schema(PostSchema())
+dump_reply = compile_schema(ReplySchema())
+REPLY_COLUMNS = [getattr(ReplyModel, name) for name in ReplySchema().dump_fields]
+
+
+class KeysetPagination:
+    """
+    A page of posts seeked by (column, id) instead of OFFSET, the column
+    is created_on unless given. Exposes the same attributes as
+    flask_sqlalchemy's Pagination so it can be rendered by Pagination,
+    plus opaque next/prev cursors.
+    """
+
+    def __init__(
+        self, query, cursor, limit, descending=False, count=False, column=None
+    ):
+        column = PostModel.created_on if column is None else column
+        self.per_page = limit
+        self.page = None
+        self.pages = None
+        # counting the whole table is what we are avoiding, so only on request
+        self.total = query.order_by(None).count() if count else None
+
+        direction, key, post_id = KeysetPagination.decode_cursor(cursor, column)
+        forward = direction == "next"
+        # walking backwards flips the sort order, the page is reversed after
+        ascending = forward != descending
+
+        if key is not None:
+            if ascending:
+                query = query.filter(
+                    db.or_(
+                        column > key,
+                        db.and_(column == key, PostModel.id > post_id),
+                    )
+                )
+            else:
+                query = query.filter(
+                    db.or_(
+                        column < key,
+                        db.and_(column == key, PostModel.id < post_id),
+                    )
+                )
+
+        if ascending:
+            query = query.order_by(column.asc(), PostModel.id.asc())
+        else:
+            query = query.order_by(column.desc(), PostModel.id.desc())
+
+        # fetch one extra row to know if there is another page
+        items = query.limit(limit + 1).all()
+        more = len(items) > limit
+        items = items[:limit]
+        if not forward:
+            items.reverse()
+        self.items = items
+
+        if forward:
+            has_next, has_prev = more, key is not None
+        else:
+            has_next, has_prev = True, more
+
+        self.next_cursor = None
+        self.prev_cursor = None
+        if items and has_next:
+            self.next_cursor = KeysetPagination.encode_cursor("next", items[-1], column)
+        if items and has_prev:
+            self.prev_cursor = KeysetPagination.encode_cursor("prev", items[0], column)
+        self.has_next = self.next_cursor is not None
+        self.has_prev = self.prev_cursor is not None
+
+    @staticmethod
+    def encode_cursor(direction, post, column):
+        key = getattr(post, column.key)
+        if isinstance(key, datetime.datetime):
+            key = key.isoformat()
+        data = json.dumps([direction, key, post.id])
+        cursor = base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+        # padding is dropped so the cursor can sit in a query string as is
+        return cursor.rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor, column):
+        # an empty cursor is the first page
+        if not cursor:
+            return "next", None, None
+
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            data = base64.urlsafe_b64decode((cursor + padding).encode("ascii"))
+            direction, key, post_id = json.loads(data)
+            if direction not in ("next", "prev"):
+                raise ValueError(direction)
+            if isinstance(column.type, db.DateTime):
+                key = datetime.datetime.fromisoformat(key)
+            elif not isinstance(key, (int, float)):
+                raise ValueError(key)
+            return direction, key, int(post_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+
 class Pagination:
-    def __init__(self, pagination, url):
+    def __init__(self, pagination, url, sort=None):
         self.limit = pagination.per_page
         self.page = pagination.page
         self.pages = pagination.pages
@@ -230,22 +814,39 @@ class Pagination:
         self.has_prev = pagination.has_prev
         self.has_next = pagination.has_next
         self.items = pagination.items
-        self.make_urls(pagination, url)
+        # the sort order is carried into the page links
+        self.make_urls(pagination, url, f"&sort={sort}" if sort else "")
         self.make_posts()
 
     def make_posts(self):
         posts = []
+        meta = PostModel.get_posts_meta(self.items)
         for item in self.items:
-            post = PostSchema().dump(item)
-            meta = PostModel.get_post_meta(item.user, post["id"])
-            posts.append({**post, **meta})
+            posts.append({**dump_post(item), **meta[item.id]})
         self.items = posts
 
-    def make_urls(self, pagination, url):
+    def make_urls(self, pagination, url, params=""):
+        if isinstance(pagination, KeysetPagination):
+            self.next_cursor = pagination.next_cursor
+            self.prev_cursor = pagination.prev_cursor
+            if self.has_next:
+                self.next_page = (
+                    f"{url}?cursor={self.next_cursor}&limit={self.limit}{params}"
+                )
+            if self.has_prev:
+                self.prev_page = (
+                    f"{url}?cursor={self.prev_cursor}&limit={self.limit}{params}"
+                )
+            return
+
         if self.has_next:
-            self.next_page = f"{url}?start={pagination.next_num}&limit={self.limit}"
+            self.next_page = (
+                f"{url}?start={pagination.next_num}&limit={self.limit}{params}"
+            )
         if self.has_prev:
-            self.prev_page = f"{url}?start={pagination.prev_num}&limit={self.limit}"
+            self.prev_page = (
+                f"{url}?start={pagination.prev_num}&limit={self.limit}{params}"
+            )
 
     def __getitem__(self, key):
         return getattr(self, key)
@@ -261,4 +862,6 @@ class Pagination:
             "has_next",
             "items",
             "prev_page",
+            "next_cursor",
+            "prev_cursor",
         )
@@ -1,8 +1,102 @@
+import datetime
 from marshmallow import fields, Schema
+from sqlalchemy.exc import IntegrityError, OperationalError
 from . import db
+from votes import vote_buffer
+
+
+def delete_duplicates(model, target, batch_size=1000):
+    # keep the oldest vote of every (target, liked_by) pair, returns the
+    # number of rows deleted
+    keep = db.session.query(db.func.min(model.id)).group_by(target, model.liked_by)
+    duplicates = [
+        row.id for row in db.session.query(model.id).filter(~model.id.in_(keep))
+    ]
+    for i in range(0, len(duplicates), batch_size):
+        model.query.filter(model.id.in_(duplicates[i : i + batch_size])).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+    return len(duplicates)
+
+
+def toggle_vote(model, target, target_id, user_id):
+    """
+    Remove the user's vote, or add it when there was none, as the first
+    writes of a transaction. Returns the change in the vote count: -1, 1,
+    or 0 when a concurrent toggle inserted the same vote first.
+    """
+    deleted = db.session.execute(
+        model.__table__.delete().where(target == target_id, model.liked_by == user_id)
+    ).rowcount
+    if deleted:
+        return -deleted
+
+    try:
+        return insert_vote(model, target, target_id, user_id)
+    except OperationalError as e:
+        if not is_deadlock(e):
+            raise
+        # two first toggles, a double click, took gap locks with their
+        # deletes under REPEATABLE READ and one lost the insert to a
+        # deadlock. Insert once more without the delete, the other
+        # toggle's vote then makes it a duplicate
+        db.session.rollback()
+        return insert_vote(model, target, target_id, user_id)
+
+
+def insert_vote(model, target, target_id, user_id):
+    # 1, or 0 when the vote exists, as the only write of the transaction
+    try:
+        db.session.execute(
+            model.__table__.insert().values(
+                {target.key: target_id, "liked_by": user_id}
+            )
+        )
+    except IntegrityError:
+        # nothing was written yet, so there is nothing to lose by rolling back
+        db.session.rollback()
+        return 0
+    return 1
+
+
+def is_deadlock(error):
+    # MySQL's ER_LOCK_DEADLOCK or PostgreSQL's deadlock_detected
+    orig = error.orig
+    code = getattr(orig, "pgcode", None) or (orig.args[0] if orig.args else None)
+    return code in (1213, "40P01")
+
+
+def write_votes(model, target, adds, removes):
+    # bulk insert and delete (target id, user id) votes in the current
+    # transaction, votes that already exist are skipped
+    table = model.__table__
+    if removes:
+        db.session.execute(
+            table.delete().where(
+                target == db.bindparam("target_id"),
+                model.liked_by == db.bindparam("user_id"),
+            ),
+            [{"target_id": t, "user_id": u} for t, u in removes],
+        )
+    if adds:
+        db.session.execute(
+            table.insert()
+            .prefix_with("OR IGNORE", dialect="sqlite")
+            .prefix_with("IGNORE", dialect="mysql"),
+            [{target.key: t, "liked_by": u} for t, u in adds],
+        )
+    return len(adds) + len(removes)
 
 
 class UpvoteModel(db.Model):
+    # one vote per user and post
+    __table_args__ = (
+        db.Index(
+            "uq_upvote_model_post_id_liked_by", "post_id", "liked_by", unique=True
+        ),
+    )
+
     id = db.Column(db.Integer(), primary_key=True)
     liked_by = db.Column(
         db.Integer,
@@ -37,15 +131,49 @@ class UpvoteModel(db.Model):
         return [upvote.liked_by for upvote in upvotes]
 
     def upvote_post(post_id, user_id):
-        existing_upvote = UpvoteModel.user_has_upvoted(post_id, user_id)
-        if existing_upvote:
-            db.session.delete(existing_upvote)
-        else:
-            existing_upvote = UpvoteModel(post_id=post_id, liked_by=user_id)
-            db.session.add(existing_upvote)
+        # imported here to avoid a circular import with PostModel
+        from models.PostModel import PostModel
+
+        if vote_buffer.enabled:
+            vote_buffer.toggle(
+                "post",
+                post_id,
+                user_id,
+                post_id,
+                lambda: UpvoteModel.user_has_upvoted(post_id, user_id),
+            )
+            count = (
+                db.session.query(PostModel.upvote_count).filter_by(id=post_id).scalar()
+            )
+            return count + vote_buffer.delta("post", post_id)
 
+        # delete or insert, bump the counter and read it back in one
+        # transaction, the unique index settles concurrent toggles
+        delta = toggle_vote(UpvoteModel, UpvoteModel.post_id, post_id, user_id)
+        if delta:
+            PostModel.update_counter(post_id, PostModel.upvote_count, delta)
+            PostModel.refresh_hot_scores([post_id])
+        count = db.session.query(PostModel.upvote_count).filter_by(id=post_id).scalar()
         db.session.commit()
-        return UpvoteModel.get_upvote_count(post_id)
+        return count
+
+    @staticmethod
+    def apply_votes(adds, removes):
+        # write buffered votes, then recount the posts they were on
+        from models.PostModel import PostModel
+
+        written = write_votes(UpvoteModel, UpvoteModel.post_id, adds, removes)
+        post_ids = sorted({post_id for post_id, _ in adds + removes})
+        upvotes = (
+            db.select(db.func.count(UpvoteModel.id))
+            .where(UpvoteModel.post_id == PostModel.id)
+            .scalar_subquery()
+        )
+        PostModel.query.filter(PostModel.id.in_(post_ids)).update(
+            {PostModel.upvote_count: upvotes}, synchronize_session=False
+        )
+        PostModel.refresh_hot_scores(post_ids)
+        return written
 
     def user_has_upvoted(post_id, user_id):
         upvote = UpvoteModel.query.filter_by(post_id=post_id, liked_by=user_id).first()
@@ -55,6 +183,16 @@ class UpvoteModel(db.Model):
 
 
 class CommentUpvoteModel(db.Model):
+    # one vote per user and comment
+    __table_args__ = (
+        db.Index(
+            "uq_comment_upvote_model_comment_id_liked_by",
+            "comment_id",
+            "liked_by",
+            unique=True,
+        ),
+    )
+
     id = db.Column(db.Integer(), primary_key=True)
     liked_by = db.Column(
         db.Integer,
@@ -88,18 +226,91 @@ class CommentUpvoteModel(db.Model):
         upvotes = CommentUpvoteModel.query.filter_by(comment_id=comment_id).all()
         return [upvote.liked_by for upvote in upvotes]
 
-    def upvote_comment(comment_id, user_id):
-        existing_upvote = CommentUpvoteModel.user_has_upvoted(comment_id, user_id)
-        if existing_upvote:
-            db.session.delete(existing_upvote)
-        else:
-            existing_upvote = CommentUpvoteModel(
-                comment_id=comment_id, liked_by=user_id
+    @staticmethod
+    def get_post_comment_upvotes(post_id):
+        # map comment_id -> liked_by ids for every comment on a post
+        upvotes = (
+            db.session.query(CommentUpvoteModel.comment_id, CommentUpvoteModel.liked_by)
+            .join(CommentUpvoteModel.comment)
+            .filter_by(post_id=post_id)
+            .order_by(CommentUpvoteModel.id.asc())
+            .all()
+        )
+        likes = {}
+        for comment_id, liked_by in upvotes:
+            likes.setdefault(comment_id, []).append(liked_by)
+        return likes
+
+    @staticmethod
+    def get_comment_upvotes(comment_ids):
+        # map comment_id -> liked_by ids for the given comments
+        if not comment_ids:
+            return {}
+        upvotes = (
+            db.session.query(CommentUpvoteModel.comment_id, CommentUpvoteModel.liked_by)
+            .filter(CommentUpvoteModel.comment_id.in_(comment_ids))
+            .order_by(CommentUpvoteModel.id.asc())
+            .all()
+        )
+        likes = {}
+        for comment_id, liked_by in upvotes:
+            likes.setdefault(comment_id, []).append(liked_by)
+        return likes
+
+    def upvote_comment(comment_id, user_id, post_id=None):
+        # imported here to avoid a circular import with PostModel
+        from models.PostModel import ReplyModel
+
+        if vote_buffer.enabled:
+            vote_buffer.toggle(
+                "comment",
+                comment_id,
+                user_id,
+                post_id,
+                lambda: CommentUpvoteModel.user_has_upvoted(comment_id, user_id),
             )
-            db.session.add(existing_upvote)
+            count = (
+                db.session.query(ReplyModel.upvote_count)
+                .filter_by(id=comment_id)
+                .scalar()
+            )
+            return count + vote_buffer.delta("comment", comment_id)
 
+        delta = toggle_vote(
+            CommentUpvoteModel, CommentUpvoteModel.comment_id, comment_id, user_id
+        )
+        if delta:
+            ReplyModel.update_counter(comment_id, ReplyModel.upvote_count, delta)
+            ReplyModel.touch_post(comment_id)
+        count = (
+            db.session.query(ReplyModel.upvote_count).filter_by(id=comment_id).scalar()
+        )
         db.session.commit()
-        return CommentUpvoteModel.get_upvote_count(comment_id)
+        return count
+
+    @staticmethod
+    def apply_votes(adds, removes):
+        # write buffered votes, recount the comments and touch their posts
+        from models.PostModel import PostModel, ReplyModel
+
+        written = write_votes(
+            CommentUpvoteModel, CommentUpvoteModel.comment_id, adds, removes
+        )
+        comment_ids = sorted({comment_id for comment_id, _ in adds + removes})
+        upvotes = (
+            db.select(db.func.count(CommentUpvoteModel.id))
+            .where(CommentUpvoteModel.comment_id == ReplyModel.id)
+            .scalar_subquery()
+        )
+        ReplyModel.query.filter(ReplyModel.id.in_(comment_ids)).update(
+            {ReplyModel.upvote_count: upvotes}, synchronize_session=False
+        )
+        post_ids = db.select(ReplyModel.post_id).where(ReplyModel.id.in_(comment_ids))
+        PostModel.query.filter(PostModel.id.in_(post_ids)).update(
+            {PostModel.modified_at: datetime.datetime.utcnow()},
+            synchronize_session=False,
+        )
+        return written
 
     def user_has_upvoted(comment_id, user_id):
         upvote = CommentUpvoteModel.query.filter_by(
@@ -1,7 +1,16 @@
 import datetime
 from marshmallow import fields, Schema
-from . import db, bcrypt
+from . import db
 from models.BlackListTokensModel import BlackListTokensModel
+from models.VersionModel import VersionModel
+from cache import blacklist_cache, user_cache, handle_index
+from hashing import password_hasher, HasherBusy
+from search import search_index
+from serializers import compile_schema
+from cursors import encode_cursor, decode_cursor
+
+# the unique, indexed columns users can be searched by
+SEARCH_FIELDS = ("id", "handle", "email")
 
 
 class UserModel(db.Model):
@@ -12,7 +21,7 @@ class UserModel(db.Model):
     email = db.Column(db.String(128), unique=True, nullable=False)
     password = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    modified_at = db.Column(db.DateTime)
+    modified_at = db.Column(db.DateTime, index=True)
 
     def __repr__(self):
         return f"User<id={self.id}, handle={self.handle}, email={self.email}>"
@@ -21,47 +30,131 @@ class UserModel(db.Model):
     def get_all(cls):
         return cls.query.all()
 
-    def find(**kwargs):
-        """Return filtered AND query results for passed in kwargs.
-        Example:
-            # find all instances of MyModel for first name 'John' AND last name 'Doe'
-            MyModel.find(first_name='John', last_name='Doe')
+    @classmethod
+    def iter_all(cls, chunk_size=500):
+        # server side cursor, only one chunk of rows is held at a time
+        return cls.query.order_by(cls.id.asc()).yield_per(chunk_size)
 
-        Returns result list or None.
+    @classmethod
+    def get_page(cls, cursor, limit):
         """
-        return UserModel.query.filter_by(**kwargs).all()
+        A page of users in id order, raises ValueError for a bad cursor
+        """
+        after = decode_cursor(cursor)
+        users = (
+            cls.query.filter(cls.id > (after or 0))
+            .order_by(cls.id.asc())
+            .limit(limit + 1)
+            .all()
+        )
+        has_next = len(users) > limit
+        users = users[:limit]
+        return {
+            "items": [dump_user(user) for user in users],
+            "has_next": has_next,
+            "next_cursor": encode_cursor(users[-1].id) if has_next else None,
+        }
+
+    @classmethod
+    def search(cls, filters, limit):
+        """
+        Users matching every filter exactly, only on indexed columns
+        """
+        unknown = set(filters) - set(SEARCH_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot search by: {', '.join(sorted(unknown))}")
+        # json arrays and objects are not values a column can equal
+        invalid = [
+            key for key, value in filters.items() if isinstance(value, (list, dict))
+        ]
+        if invalid:
+            raise ValueError(f"Not a single value: {', '.join(sorted(invalid))}")
+        return cls.query.filter_by(**filters).order_by(cls.id.asc()).limit(limit).all()
+
+    @classmethod
+    def get_handles(cls):
+        return db.session.query(cls.id, cls.handle).all()
 
     @classmethod
     def get_by_id(cls, id):
         return cls.query.get_or_404(id)
 
-    @staticmethod
-    def logout(token):
+    @classmethod
+    def get_modified_at(cls, id):
+        return db.session.query(cls.modified_at).filter_by(id=id).scalar()
+
+    @classmethod
+    def get_cached(cls, id):
+        # detached user from the per process cache, loaded on a miss
+        user = user_cache.get(id)
+        if user is None:
+            row = cls.query.filter_by(id=id).first()
+            if row is None:
+                return None
+            user = CachedUser(row)
+            user_cache.set(id, user)
+        return user
+
+    def logout(self, token):
         print(f"Logging out User<{token}>")
         bl_token = BlackListTokensModel(token=token)
         bl_token.add()
+        blacklist_cache.revoke(token)
+        user_cache.pop(self.id)
 
     def save(self):
         db.session.add(self)
         db.session.commit()
+        handle_index.add(self.id, self.handle)
 
     def delete(self):
+        # imported here to avoid a circular import with the post model
+        from models.PostModel import PostModel
+
+        # their posts go in the cascade, note the ids while they exist
+        post_ids = [
+            row.id for row in db.session.query(PostModel.id).filter_by(user_id=self.id)
+        ]
         db.session.delete(self)
+        # their posts are deleted by the cascade
+        VersionModel.bump("posts_deleted")
         db.session.commit()
+        user_cache.pop(self.id)
+        handle_index.remove(self.id)
+        # their posts and replies went with them, and so did the replies
+        # of other users on their posts
+        search_index.remove_user(self.id, post_ids)
 
     def generate_hash(self, password):
-        return bcrypt.generate_password_hash(password, rounds=10).decode("utf-8")
+        # bcrypt runs in the hashing process pool
+        return password_hasher.hash(password)
 
     def check_hash(self, password):
         try:
-            valid = bcrypt.check_password_hash(self.password, password)
+            valid = password_hasher.check(self.password, password)
             if valid:
                 return True, None
             else:
                 return False, "Password is incorrect"
+        except HasherBusy:
+            raise
         except Exception as e:
             return (False, e)
 
+    def rehash(self, password):
+        # bring a hash made with an older cost up to PASSWORD_ROUNDS,
+        # only called with a password that was just verified
+        if not password_hasher.needs_rehash(self.password):
+            return False
+        try:
+            self.password = self.generate_hash(password)
+        except HasherBusy:
+            # not worth failing the login over, retried on the next one
+            return False
+        db.session.commit()
+        user_cache.pop(self.id)
+        return True
+
     def update(self, data):
         for key, item in data.items():
             if key == "password":
@@ -70,6 +163,8 @@ class UserModel(db.Model):
             setattr(self, key, item)
         self.modified_at = datetime.datetime.utcnow()
         db.session.commit()
+        user_cache.pop(self.id)
+        handle_index.add(self.id, self.handle)
 
     def update_password(self, old_password, new_password):
         valid, error = self.check_hash(old_password)
@@ -77,11 +172,59 @@ class UserModel(db.Model):
             self.password = self.generate_hash(new_password)
             self.modified_at = datetime.datetime.utcnow()
             db.session.commit()
+            user_cache.pop(self.id)
             return True
         else:
             return False
 
 
+class CachedUser(object):
+    """
+    Detached copy of a UserModel row handed to the routes by the auth
+    decorators. Writes load the row and go through UserModel. The password
+    hash is left out, a password changed on another worker has to stop
+    working at once rather than when this copy expires.
+    """
+
+    __slots__ = (
+        "id",
+        "fname",
+        "lname",
+        "handle",
+        "email",
+        "created_at",
+        "modified_at",
+    )
+
+    def __init__(self, user):
+        for field in self.__slots__:
+            setattr(self, field, getattr(user, field))
+
+    def __repr__(self):
+        return f"User<id={self.id}, handle={self.handle}, email={self.email}>"
+
+    def model(self):
+        return UserModel.query.filter_by(id=self.id).first()
+
+    def check_hash(self, password):
+        user = self.model()
+        if user is None:
+            return False, "User not found"
+        return user.check_hash(password)
+
+    def logout(self, token):
+        self.model().logout(token)
+
+    def update(self, data):
+        self.model().update(data)
+
+    def update_password(self, old_password, new_password):
+        return self.model().update_password(old_password, new_password)
+
+    def delete(self):
+        self.model().delete()
+
+
 class UserSchema(Schema):
     id = fields.Integer()
     fname = fields.String()
@@ -91,3 +234,7 @@ class UserSchema(Schema):
     # password = fields.String()
     created_at = fields.DateTime()
     modified_at = fields.DateTime()
+
+
+# compiled once, for listings and streams of users
+dump_user = compile_schema(UserSchema())
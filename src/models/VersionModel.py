@@ -0,0 +1,53 @@
+import datetime
+from sqlalchemy.exc import IntegrityError
+from . import db
+
+
+class VersionModel(db.Model):
+    # named counters for changes no column of the changed rows can show,
+    # e.g. deletes, bumped in the same transaction as the change
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    # time of the last bump, the Last-Modified of what the counter tracks
+    changed_at = db.Column(
+        db.DateTime,
+        default=datetime.datetime.utcnow,
+        onupdate=datetime.datetime.utcnow,
+    )
+
+    def __repr__(self):
+        return f"Version<name={self.name}, value={self.value}>"
+
+    @staticmethod
+    def bump(name):
+        updated = VersionModel.query.filter_by(name=name).update(
+            {VersionModel.value: VersionModel.value + 1}, synchronize_session=False
+        )
+        if updated:
+            return
+
+        # first bump, a concurrent one may create the row before us
+        try:
+            with db.session.begin_nested():
+                db.session.add(VersionModel(name=name, value=1))
+        except IntegrityError:
+            VersionModel.bump(name)
+
+    @staticmethod
+    def current(name):
+        # scalar subquery of the counter, 0 before its first bump
+        return db.func.coalesce(
+            db.select(VersionModel.value)
+            .where(VersionModel.name == name)
+            .scalar_subquery(),
+            0,
+        )
+
+    @staticmethod
+    def changed(name):
+        # scalar subquery of the last bump's time, None before the first
+        return (
+            db.select(VersionModel.changed_at)
+            .where(VersionModel.name == name)
+            .scalar_subquery()
+        )
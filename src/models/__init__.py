@@ -1,9 +1,42 @@
 # src/models/__init__.py
 
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from flask_bcrypt import Bcrypt
+from sqlalchemy import orm
+from sqlalchemy.pool import QueuePool
+from routing import replica_router
+
+# queue settings, SQLite runs on a pool without a queue
+QUEUE_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending reads to the replica bind when the router asks for it
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        # flushes and insert, update or delete statements stay on the primary
+        if (
+            not self._flushing
+            and not getattr(clause, "is_dml", False)
+            and replica_router.use_replica()
+        ):
+            return db.get_engine(self.app, bind="replica")
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        if engine_opts.get("poolclass", QueuePool) is not QueuePool:
+            for option in QUEUE_POOL_OPTIONS:
+                engine_opts.pop(option, None)
+        return super().create_engine(sa_url, engine_opts)
 
 
 # initialize our db
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 bcrypt = Bcrypt()
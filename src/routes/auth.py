@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, request, make_response, session
+from flask import Blueprint, jsonify, request, make_response, session, current_app
 import datetime
 import os, jwt
 from sqlalchemy.exc import SQLAlchemyError
@@ -7,12 +7,16 @@ from flask_cors import cross_origin
 # models
 from models.UserModel import UserModel, UserSchema
 from decorators import token_required
+from hashing import HasherBusy
 
 # create a blueprint
 auth_bp = Blueprint("auth_bp", __name__)
 
 
-def create_token(id, exp=30):
+def create_token(id, exp=None):
+    # token lifetime in minutes, also the blacklist retention period
+    if exp is None:
+        exp = current_app.config["JWT_EXPIRY_MINUTES"]
     return jwt.encode(
         {
             "id": id,
@@ -31,7 +35,8 @@ def verify_password(user):
         return jsonify({"error": "Password not provided"}), 500
 
     # verify the password
-    if user.check_hash(data.get("password")):
+    valid, error = user.check_hash(data.get("password"))
+    if valid:
         return jsonify({"message": "Password is valid"}), 200
     else:
         return jsonify({"error": "Password is invalid"}), 403
@@ -60,6 +65,9 @@ def login():
     try:
         valid, status = user.check_hash(auth["password"])
         if valid:
+            # upgrade hashes made with an older cost while we have the password
+            user.rehash(auth["password"])
+
             # generates the JWT Token
             token = create_token(user.id)
 
@@ -74,6 +82,9 @@ def login():
 
         # returns 403 if password is wrong
         return jsonify(f"Could not verify - {status}"), 403
+    except HasherBusy:
+        # answered with 503 by the error handler
+        raise
     except Exception as e:
         return jsonify(f"Could not verify - {e}"), 403
 
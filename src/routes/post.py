@@ -1,4 +1,6 @@
-from flask import Blueprint, jsonify, request, session
+import datetime
+import time
+from flask import Blueprint, jsonify, request, session, current_app, g
 
 # models
 from models.PostModel import (
@@ -6,47 +8,216 @@ from models.PostModel import (
     ReplyModel,
     UpvoteModel,
     Pagination,
-    ReplySchema,
-    PostSchema,
+    dump_post,
+    dump_reply,
 )
-from decorators import token_required
+from decorators import token_required, conditional
 from models.UpvoteModel import CommentUpvoteModel
+from cache import post_cache
+from search import search_index
+from votes import vote_buffer
 
 
 # create a blueprint
 post_bp = Blueprint("post_bp", __name__)
 
+
+def post_version(current_user, id):
+    version = PostModel.get_post_version(id)
+    if version is None:
+        return None
+    # buffered votes change the body before they reach modified_at
+    generation = vote_buffer.generation(id)
+    parts = (*version, generation)
+    # every part of the ETag moves Last-Modified too, or If-Modified-Since
+    # would answer 304 for a body that changed
+    changes = [*version, vote_buffer.changed_at if generation else None]
+    return parts, max(filter(None, changes), default=None)
+
+
+def posts_version(current_user):
+    version = PostModel.get_posts_version()
+    parts = (*version, vote_buffer.version)
+    # the times of the post and user changes, the last delete and the
+    # last buffered vote, so If-Modified-Since agrees with the ETag
+    changes = [*version[1:3], version[4], vote_buffer.changed_at]
+    if request.args.get("sort") == "hot":
+        # hot scores decay without touching modified_at
+        interval = current_app.config.get("HOT_SCORE_DECAY_INTERVAL") or 60
+        bucket = int(time.time() // interval)
+        parts += (bucket,)
+        changes.append(datetime.datetime.utcfromtimestamp(bucket * interval))
+    return parts, max(filter(None, changes), default=None)
+
+
 # get post by id
 @post_bp.route("/post/<int:id>", methods=["GET"])
 @token_required
+@conditional(post_version)
 def get_post(current_user, id):
-    post = PostModel.get_post(id)
+    # optional limits on the comment tree, cut branches carry a cursor
+    max_depth = request.args.get("max_depth", type=int)
+    max_children = request.args.get("max_children", type=int)
+    if (max_depth or 0) < 0 or (max_children or 0) < 0:
+        return (
+            jsonify({"message": "max_depth and max_children can not be negative"}),
+            400,
+        )
+
+    # the rendered body is cached per version of the post, a write on
+    # another worker changes the version even though it can not
+    # invalidate this worker's cache
+    payload = post_cache.get_or_build(
+        (id, max_depth, max_children, g.get("version")),
+        lambda: render_post(id, max_depth, max_children),
+    )
+    if payload is None:
+        return jsonify({"message": "Post not found"}), 404
+    return current_app.response_class(payload, mimetype="application/json"), 200
+
+
+def render_post(id, max_depth, max_children):
+    post = PostModel.get_post(id, max_depth=max_depth, max_children=max_children)
+    if not post:
+        return None
+    return jsonify(post).get_data()
+
+
+# page through the root comments of a post
+@post_bp.route("/post/<int:id>/comments", methods=["GET"])
+@token_required
+def get_post_comments(current_user, id):
+    post = PostModel.get_post(id, True)
     if not post:
         return jsonify({"message": "Post not found"}), 404
-    return jsonify(post), 200
+
+    return reply_page(None, id)
+
+
+# page through the replies of a comment
+@post_bp.route("/comment/<int:comment_id>/replies", methods=["GET"])
+@token_required
+def get_comment_replies(current_user, comment_id):
+    comment = ReplyModel.get_reply(comment_id)
+    if not comment:
+        return jsonify({"message": "Comment not found"}), 404
+
+    return reply_page(comment, comment.post_id)
+
+
+def reply_page(parent, post_id):
+    limit = max(1, min(int(request.args.get("limit", 20)), 100))
+    max_depth = int(request.args.get("max_depth", 2))
+    max_children = request.args.get("max_children", type=int)
+    if max_depth < 0 or (max_children or 0) < 0:
+        return (
+            jsonify({"message": "max_depth and max_children can not be negative"}),
+            400,
+        )
+    try:
+        page = ReplyModel.get_reply_page(
+            post_id,
+            parent,
+            request.args.get("cursor"),
+            limit,
+            max_depth,
+            max_children,
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify(page), 200
 
 
 # get user posts
 @post_bp.route("/posts/me", methods=["GET"])
 @token_required
 def get_user_posts(current_user):
+    # cursor mode, pass an empty cursor for the first page
+    if "cursor" in request.args:
+        limit = int(request.args.get("limit", 5))
+        count = request.args.get("count", "").lower() == "true"
+        try:
+            paginated = PostModel.keyset_user_posts(
+                current_user.id, request.args.get("cursor"), limit, count
+            )
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+
+        pagination = Pagination(paginated, "/posts/me")
+        return jsonify(pagination.__dict__), 200
+
     posts = PostModel.get_user_posts(current_user.id)
-    posts = PostSchema().dump(posts, many=True)
+    posts = [dump_post(post) for post in posts]
     return jsonify(posts), 200
 
 
 # Get all user records
 @post_bp.route("/posts", methods=["GET"])
 @token_required
+@conditional(posts_version)
 def get_paginated_posts(current_user):
     start = int(request.args.get("start", 1))
     limit = int(request.args.get("limit", 5))
-
-    paginated = PostModel.paginate_posts(start, limit)
-    pagination = Pagination(paginated, "/posts")
+    # hot, top or new, oldest first when not given
+    sort = request.args.get("sort")
+
+    try:
+        # cursor mode, pass an empty cursor for the first page
+        if "cursor" in request.args:
+            count = request.args.get("count", "").lower() == "true"
+            paginated = PostModel.keyset_posts(
+                request.args.get("cursor"), limit, count, sort
+            )
+        else:
+            paginated = PostModel.paginate_posts(start, limit, sort)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    pagination = Pagination(paginated, "/posts", sort)
     return jsonify(pagination.__dict__), 200
 
 
+# full text search over posts and replies
+@post_bp.route("/search", methods=["GET"])
+@token_required
+def search(current_user):
+    query = request.args.get("q", "")
+    if not query.strip():
+        return jsonify({"message": "No search query provided"}), 400
+
+    start = max(int(request.args.get("start", 1)), 1)
+    limit = max(1, min(int(request.args.get("limit", 20)), 100))
+    if not search_index.loaded:
+        # startup may have run before the tables existed
+        search_index.load(
+            PostModel.query.yield_per(1000), ReplyModel.query.yield_per(1000)
+        )
+    total, results = search_index.search(query, (start - 1) * limit, limit)
+    return (
+        jsonify(
+            {
+                "query": query,
+                "total": total,
+                "start": start,
+                "limit": limit,
+                "has_next": start * limit < total,
+                "results": [
+                    {
+                        "type": document["kind"],
+                        "id": document["id"],
+                        "post_id": document["post_id"],
+                        "title": document["title"],
+                        "isClosed": document["isClosed"],
+                        "snippet": snippet,
+                        "score": round(score, 4),
+                    }
+                    for document, score, snippet in results
+                ],
+            }
+        ),
+        200,
+    )
+
+
 @post_bp.route("/post", methods=["POST"])
 @token_required
 def create_post(current_user):
@@ -78,6 +249,7 @@ def close_post(current_user, id):
         return jsonify({"message": "Unauthorized"}), 401
 
     post.close()
+    post_cache.invalidate(id)
     return jsonify({"message": "Post closed"}), 200
 
 
@@ -92,6 +264,7 @@ def delete_post(current_user, id):
         return jsonify({"message": "Unauthorized action"}), 401
 
     post.delete()
+    post_cache.invalidate(id)
     return jsonify({"message": "Post deleted successfully"}), 200
 
 
@@ -99,11 +272,12 @@ def delete_post(current_user, id):
 @post_bp.route("/post/<int:post_id>/upvote", methods=["PUT"])
 @token_required
 def upvote_post(current_user, post_id):
-    post = PostModel.get_post(post_id)
+    post = PostModel.get_post(post_id, True)
     if not post:
         return jsonify({"message": "Post not found"}), 404
 
     upvoted = UpvoteModel.upvote_post(post_id, current_user.id)
+    post_cache.invalidate(post_id)
     return jsonify({"message": "Vote posted successfully", "upvotes": upvoted}), 200
 
 
@@ -116,11 +290,11 @@ def create_comment(current_user, post_id):
     if not data.get("text"):
         return jsonify({"message": "No input data provided"}), 400
 
-    post = PostModel.get_post(post_id)
+    post = PostModel.get_post(post_id, True)
     if not post:
         return jsonify({"message": "Post not found"}), 404
 
-    if post["isClosed"]:
+    if post.isClosed:
         return jsonify({"message": "Post is closed"}), 400
 
     post = ReplyModel(
@@ -129,7 +303,8 @@ def create_comment(current_user, post_id):
         post_id=post_id,
     )
     post.add()
-    return jsonify(ReplySchema().dump(post)), 200
+    post_cache.invalidate(post_id)
+    return jsonify(dump_reply(post)), 200
 
 
 @post_bp.route("/reply/<int:reply_id>", methods=["PUT", "POST"])
@@ -139,12 +314,16 @@ def create_reply(current_user, reply_id):
     if not reply:
         return jsonify({"message": "Comment not found"}), 404
 
-    post = PostModel.get_post(reply.post_id)
+    post = PostModel.get_post(reply.post_id, True)
     if not post:
         return jsonify({"message": "Post not found"}), 404
 
-    if post["isClosed"]:
+    if post.isClosed:
         return jsonify({"message": "Post is closed"}), 400
+
+    # the materialized path has room for MAX_DEPTH levels
+    if reply.depth >= ReplyModel.MAX_DEPTH:
+        return jsonify({"message": "Thread is too deep"}), 400
     # heirarchical reply
     data = request.get_json()
     if not data:
@@ -160,6 +339,7 @@ def create_reply(current_user, reply_id):
     )
 
     reply.add()
+    post_cache.invalidate(reply.post_id)
     return jsonify({"message": "Reply posted successfully"}), 200
 
 
@@ -175,6 +355,7 @@ def delete_comment(current_user, comment_id):
         return jsonify({"message": "Unauthorized action"}), 401
 
     comment.delete()
+    post_cache.invalidate(comment.post_id)
     return jsonify({"message": "Comment deleted successfully"}), 200
 
 
@@ -186,5 +367,8 @@ def upvote_comment(current_user, comment_id):
     if not post:
         return jsonify({"message": "Comment not found"}), 404
 
-    upvoted = CommentUpvoteModel.upvote_comment(comment_id, current_user.id)
+    upvoted = CommentUpvoteModel.upvote_comment(
+        comment_id, current_user.id, post.post_id
+    )
+    post_cache.invalidate(post.post_id)
     return jsonify({"message": "Vote posted successfully", "upvotes": upvoted}), 200
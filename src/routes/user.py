@@ -1,9 +1,14 @@
-from flask import Blueprint, jsonify, request, session
+from flask import Blueprint, Response, json, jsonify, request, session
+from flask import stream_with_context
 from sqlalchemy.exc import SQLAlchemyError
 
 # models
-from models.UserModel import UserModel, UserSchema
-from decorators import token_required
+from models.UserModel import UserModel, UserSchema, dump_user
+from decorators import token_required, conditional
+from cache import handle_index
+
+# most users a search or autocomplete returns
+MAX_RESULTS = 100
 
 # create a blueprint
 user_bp = Blueprint("user_bp", __name__)
@@ -12,10 +17,38 @@ user_bp = Blueprint("user_bp", __name__)
 @user_bp.route("/users", methods=["GET"])
 @token_required
 def get_all_users(_):
-    users = UserModel.get_all()
-    serializer = UserSchema(many=True)
-    data = serializer.dump(users)
-    return jsonify(data), 200
+    # cursor mode, pass an empty cursor or a limit for the first page
+    if "cursor" in request.args or "limit" in request.args:
+        # a page holds at least one user, or there is no cursor to go on from
+        limit = max(1, min(int(request.args.get("limit", 20)), MAX_RESULTS))
+        try:
+            page = UserModel.get_page(request.args.get("cursor"), limit)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        return jsonify(page), 200
+
+    # stream the whole array so memory stays flat as the table grows
+    return Response(stream_with_context(stream_users()), mimetype="application/json")
+
+
+def stream_users(chunk_size=500):
+    # one write per chunk of rows rather than per user
+    chunk, separator = ["["], ""
+    for user in UserModel.iter_all(chunk_size):
+        chunk.append(separator + json.dumps(dump_user(user)))
+        separator = ","
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    chunk.append("]\n")
+    yield "".join(chunk)
+
+
+def user_version(_, id):
+    modified_at = UserModel.get_modified_at(id)
+    if modified_at is None:
+        return None
+    return modified_at, modified_at
 
 
 """
@@ -26,13 +59,13 @@ Find user by id
 
 @user_bp.route("/user/<int:id>", methods=["GET"])
 @token_required
+@conditional(user_version)
 def get_user(_, id):
     """
     Get a user record
     @params: id"""
     users = UserModel.get_by_id(id)
-    serializer = UserSchema()
-    data = serializer.dump(users)
+    data = dump_user(users)
 
     return jsonify(data), 200
 
@@ -49,15 +82,34 @@ def find(_):
     """
     Find specific records"""
     args = request.get_json()
-    if args is None or args == {}:
+    if not isinstance(args, dict) or args == {}:
         return jsonify({"ERROR": "No arguments provided!"}), 400
 
-    users = UserModel.find(**args)
-    serializer = UserSchema(many=True)
-    data = serializer.dump(users)
+    limit = max(1, min(int(request.args.get("limit", 20)), MAX_RESULTS))
+    try:
+        users = UserModel.search(args, limit)
+    except ValueError as e:
+        return jsonify({"ERROR": str(e)}), 400
+    data = [dump_user(user) for user in users]
     return jsonify(data), 200
 
 
+# handle prefix autocomplete for @mentions, served from memory
+@user_bp.route("/users/autocomplete", methods=["GET"])
+@token_required
+def autocomplete(_):
+    prefix = request.args.get("q", "").lstrip("@")
+    if not prefix:
+        return jsonify({"ERROR": "No prefix provided!"}), 400
+
+    limit = max(1, min(int(request.args.get("limit", 10)), MAX_RESULTS))
+    # startup may have run before the users table existed
+    if not handle_index.loaded:
+        handle_index.load(UserModel.get_handles())
+    matches = handle_index.complete(prefix, limit)
+    return jsonify([{"id": id, "handle": handle} for handle, id in matches]), 200
+
+
 # Update a user record
 @user_bp.route("/user/update", methods=["PUT"])
 @token_required
@@ -0,0 +1,84 @@
+# src/routing.py
+from flask import g, has_request_context, request
+from itsdangerous import BadSignature, TimestampSigner
+
+# cookie carrying a writer's pin to whichever worker serves their next read
+PIN_COOKIE = "replica_pin"
+
+
+class ReplicaRouter(object):
+    """
+    Sends the reads of GET requests on the post and user routes to the
+    "replica" bind when SQLALCHEMY_BINDS has one. A user whose write
+    succeeded reads from the primary for REPLICA_PIN_SECONDS afterwards,
+    so they see their own writes despite the replication lag.
+
+    The pin travels with the client as a cookie holding their user id
+    signed with the time of the write, so it holds on every worker and
+    can neither be forged nor kept past REPLICA_PIN_SECONDS.
+    """
+
+    BLUEPRINTS = ("post_bp", "user_bp")
+    READ_METHODS = ("GET", "HEAD")
+
+    def __init__(self):
+        self.enabled = False
+        self.pin_seconds = 0
+        self.signer = None
+
+    def init_app(self, app):
+        self.enabled = "replica" in (app.config.get("SQLALCHEMY_BINDS") or {})
+        self.pin_seconds = app.config.get("REPLICA_PIN_SECONDS", 5)
+        if not self.enabled:
+            return
+        self.signer = TimestampSigner(app.config["JWT_SECRET_KEY"], salt=PIN_COOKIE)
+        app.after_request(self.after_request)
+
+    def use_replica(self):
+        # called for every statement, reads outside a request stay on the primary
+        if not self.enabled or not has_request_context():
+            return False
+        if request.method not in ReplicaRouter.READ_METHODS:
+            return False
+        if request.blueprint not in ReplicaRouter.BLUEPRINTS:
+            return False
+        user_id = g.get("user_id")
+        if user_id is None:
+            # the token lookups run before the user is known, their
+            # answer must not stick for the rest of the request
+            return True
+        if "replica_pinned" not in g:
+            g.replica_pinned = self.pinned(user_id)
+        return not g.replica_pinned
+
+    def pinned(self, user_id):
+        cookie = request.cookies.get(PIN_COOKIE)
+        if user_id is None or not cookie:
+            return False
+        try:
+            pinned_id = self.signer.unsign(cookie, max_age=self.pin_seconds)
+        except BadSignature:
+            # expired, tampered with or signed with another key
+            return False
+        return pinned_id.decode() == str(user_id)
+
+    def after_request(self, response):
+        # token_required sets the user, a failed write changed nothing
+        user_id = g.get("user_id")
+        if (
+            user_id is not None
+            and request.method not in ReplicaRouter.READ_METHODS + ("OPTIONS",)
+            and response.status_code < 400
+            and self.pin_seconds > 0
+        ):
+            response.set_cookie(
+                PIN_COOKIE,
+                self.signer.sign(str(user_id)).decode(),
+                max_age=self.pin_seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+replica_router = ReplicaRouter()
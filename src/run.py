@@ -7,6 +7,8 @@ load_dotenv()
 
 # custom imports
 from app import create_app
+from tasks import start_background_tasks
+from metrics import metrics
 
 # create and configure the flask app
 # IMPORTANT: set the FLASK_ENV environment variable to 'development' or 'production'
@@ -16,6 +18,11 @@ API_URL = "/api/v1"
 
 # create app and configure CORS
 app = create_app(env_name)
+
+# background jobs, e.g. sweeping expired blacklisted tokens
+start_background_tasks(app)
+# request latency and SQL accounting, served at /metrics
+metrics.init_app(app)
 # cors = CORS(app, supports_credentials=True)
 """
 CORS Issues : https://stackoverflow.com/questions/25594893/how-to-enable-cors-in-flask, https://github.com/corydolphin/flask-cors/issues/199
@@ -0,0 +1,311 @@
+# src/search.py
+import html
+import math
+import re
+import sqlite3
+import threading
+
+# words are runs of letters and digits, matched case insensitively
+TOKEN = re.compile(r"\w+", re.UNICODE)
+SNIPPET_WORDS = 16
+MARK = ("<mark>", "</mark>")
+# placeholders for MARK while the snippet is html escaped
+SENTINEL = ("\x02", "\x03")
+
+
+def escape(snippet):
+    snippet = html.escape(snippet)
+    return snippet.replace(SENTINEL[0], MARK[0]).replace(SENTINEL[1], MARK[1])
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN.findall(text or "")]
+
+
+def post_document(post):
+    return {
+        "kind": "post",
+        "id": post.id,
+        "post_id": post.id,
+        "user_id": post.user_id,
+        "title": post.title,
+        "text": post.text,
+        "isClosed": bool(post.isClosed),
+    }
+
+
+def reply_document(reply):
+    return {
+        "kind": "reply",
+        "id": reply.id,
+        "post_id": reply.post_id,
+        "user_id": reply.user_id,
+        "title": None,
+        "text": reply.text,
+        "isClosed": None,
+    }
+
+
+def highlight(text, terms):
+    # a window of the text around the first match, matches wrapped in MARK
+    words = (text or "").split()
+    hits = [i for i, word in enumerate(words) if set(tokenize(word)) & terms]
+    start = max(0, hits[0] - SNIPPET_WORDS // 4) if hits else 0
+    window = words[start : start + SNIPPET_WORDS]
+
+    def mark(match):
+        if match.group().lower() in terms:
+            return SENTINEL[0] + match.group() + SENTINEL[1]
+        return match.group()
+
+    snippet = " ".join(TOKEN.sub(mark, word) for word in window)
+    if start > 0:
+        snippet = "..." + snippet
+    if start + SNIPPET_WORDS < len(words):
+        snippet += "..."
+    return escape(snippet)
+
+
+class MemoryBackend(object):
+    """
+    In process inverted index over post titles, post texts and replies,
+    ranked with BM25. Each worker holds its own copy.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = {}  # term -> {doc key: term frequency}
+        self.documents = {}  # doc key -> (document, length)
+        self.threads = {}  # post id -> doc keys of the post and its replies
+        self.total_length = 0
+
+    def add(self, document):
+        key = (document["kind"], document["id"])
+        self.remove(key)
+
+        terms = tokenize(document["title"]) + tokenize(document["text"])
+        for term in terms:
+            postings = self.postings.setdefault(term, {})
+            postings[key] = postings.get(key, 0) + 1
+        self.documents[key] = (document, len(terms))
+        self.threads.setdefault(document["post_id"], set()).add(key)
+        self.total_length += len(terms)
+
+    def remove(self, key):
+        entry = self.documents.pop(key, None)
+        if entry is None:
+            return
+        document, length = entry
+        self.total_length -= length
+        self.threads[document["post_id"]].discard(key)
+        if not self.threads[document["post_id"]]:
+            del self.threads[document["post_id"]]
+        for term in set(tokenize(document["title"]) + tokenize(document["text"])):
+            postings = self.postings[term]
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[term]
+
+    def keys(self, field, value):
+        if field == "post_id":
+            return list(self.threads.get(value, ()))
+        return [
+            key
+            for key, (document, _) in self.documents.items()
+            if document[field] == value
+        ]
+
+    def search(self, terms, offset, limit):
+        # documents containing every term, best BM25 score first
+        postings = [self.postings.get(term, {}) for term in terms]
+        if not postings or not all(postings):
+            return 0, []
+        matches = set.intersection(*(set(p) for p in postings))
+
+        count = len(self.documents)
+        average = self.total_length / count
+        scores = []
+        for key in matches:
+            document, length = self.documents[key]
+            norm = self.K1 * (1 - self.B + self.B * length / average)
+            score = 0.0
+            for p in postings:
+                idf = math.log(1 + (count - len(p) + 0.5) / (len(p) + 0.5))
+                score += idf * p[key] * (self.K1 + 1) / (p[key] + norm)
+            scores.append((-score, key))
+        scores.sort()
+
+        results = []
+        for score, key in scores[offset : offset + limit]:
+            document = self.documents[key][0]
+            snippet = highlight(document["text"], set(terms))
+            results.append((document, -score, snippet))
+        return len(matches), results
+
+
+class Fts5Backend(object):
+    """
+    SQLite FTS5 index in an in memory database, one per process. Documents
+    are keyed by rowid, so updates never scan the unindexed columns.
+    """
+
+    KINDS = ("post", "reply")
+
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS documents"
+                " USING fts5(closed UNINDEXED, title, text)"
+            )
+            # owners of each document, for removing threads and users
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS owners (rowid INTEGER PRIMARY KEY,"
+                " post_id INTEGER, user_id INTEGER)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_owners_post_id ON owners (post_id)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_owners_user_id ON owners (user_id)"
+            )
+
+    @staticmethod
+    def rowid(key):
+        kind, id = key
+        return id * len(Fts5Backend.KINDS) + Fts5Backend.KINDS.index(kind)
+
+    @staticmethod
+    def key(rowid):
+        id, kind = divmod(rowid, len(Fts5Backend.KINDS))
+        return Fts5Backend.KINDS[kind], id
+
+    def add(self, document):
+        rowid = Fts5Backend.rowid((document["kind"], document["id"]))
+        with self.conn:
+            self.conn.execute("DELETE FROM documents WHERE rowid = ?", (rowid,))
+            self.conn.execute(
+                "INSERT INTO documents (rowid, closed, title, text) VALUES (?, ?, ?, ?)",
+                (rowid, document["isClosed"], document["title"], document["text"]),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO owners VALUES (?, ?, ?)",
+                (rowid, document["post_id"], document["user_id"]),
+            )
+
+    def remove(self, key):
+        rowid = Fts5Backend.rowid(key)
+        with self.conn:
+            self.conn.execute("DELETE FROM documents WHERE rowid = ?", (rowid,))
+            self.conn.execute("DELETE FROM owners WHERE rowid = ?", (rowid,))
+
+    def keys(self, field, value):
+        # field is post_id or user_id, never user input
+        rows = self.conn.execute(
+            f"SELECT rowid FROM owners WHERE {field} = ?", (value,)
+        )
+        return [Fts5Backend.key(rowid) for rowid, in rows]
+
+    def search(self, terms, offset, limit):
+        # every term quoted, so user input is never parsed as FTS5 syntax
+        query = " ".join('"%s"' % term for term in terms)
+        total = self.conn.execute(
+            "SELECT count(*) FROM documents WHERE documents MATCH ?", (query,)
+        ).fetchone()[0]
+        rows = self.conn.execute(
+            "SELECT documents.rowid, owners.post_id, owners.user_id, closed, title,"
+            " text, bm25(documents), snippet(documents, 2, ?, ?, '...', ?)"
+            " FROM documents JOIN owners ON owners.rowid = documents.rowid"
+            " WHERE documents MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+            (SENTINEL[0], SENTINEL[1], SNIPPET_WORDS, query, limit, offset),
+        )
+
+        results = []
+        for rowid, post_id, user_id, closed, title, text, rank, snippet in rows:
+            kind, id = Fts5Backend.key(rowid)
+            document = {
+                "kind": kind,
+                "id": id,
+                "post_id": post_id,
+                "user_id": user_id,
+                "title": title,
+                "text": text,
+                "isClosed": None if closed is None else bool(closed),
+            }
+            # bm25() is negative, lower is better
+            results.append((document, -rank, escape(snippet)))
+        return total, results
+
+
+BACKENDS = {"memory": MemoryBackend, "fts5": Fts5Backend}
+
+
+class SearchIndex(object):
+    """
+    Full text index of posts and replies behind a pluggable backend,
+    updated by the model writes in this process and rebuilt on startup and
+    every SEARCH_INDEX_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.backend = MemoryBackend()
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.backend = BACKENDS[app.config.get("SEARCH_BACKEND", "memory")]()
+        self.loaded = False
+
+    def load(self, posts, replies):
+        # filled off to the side and swapped in, so writes never wait on it
+        backend = type(self.backend)()
+        for post in posts:
+            backend.add(post_document(post))
+        for reply in replies:
+            backend.add(reply_document(reply))
+        with self._lock:
+            self.backend = backend
+            self.loaded = True
+
+    def add_post(self, post):
+        with self._lock:
+            self.backend.add(post_document(post))
+
+    def add_reply(self, reply):
+        with self._lock:
+            self.backend.add(reply_document(reply))
+
+    def remove_post(self, post_id):
+        # replies go with their post, the foreign key cascades
+        with self._lock:
+            for key in self.backend.keys("post_id", post_id):
+                self.backend.remove(key)
+
+    def remove_reply(self, reply_id):
+        with self._lock:
+            self.backend.remove(("reply", reply_id))
+
+    def remove_user(self, user_id, post_ids=()):
+        # their posts take other users' replies with them in the cascade
+        with self._lock:
+            for key in self.backend.keys("user_id", user_id):
+                self.backend.remove(key)
+            for post_id in post_ids:
+                for key in self.backend.keys("post_id", post_id):
+                    self.backend.remove(key)
+
+    def search(self, query, offset=0, limit=20):
+        """
+        Posts and replies containing every word of the query, best match
+        first. Returns (total matches, [(document, score, snippet)]).
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+        with self._lock:
+            return self.backend.search(terms, offset, limit)
+
+
+search_index = SearchIndex()
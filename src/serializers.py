@@ -0,0 +1,113 @@
+# src/serializers.py
+import re
+
+from flask.json import JSONEncoder
+from marshmallow import fields
+
+try:
+    import orjson
+except ImportError:  # optional, the standard encoder is used without it
+    orjson = None
+
+# orjson writes floats in exponent form or below 1e-04 differently from
+# the json module, 1e16 for 1e+16 and 0.00001 for 1e-05. With every digit
+# mapped to 0 those show up as "0e" or "0.0000", a plain substring search
+# that is much cheaper than a regex. Strings can match too, they just fall
+# back to the json module
+DIGITS = bytes.maketrans(b"123456789E", b"000000000e")
+# characters the json module escapes when ensure_ascii is on, its own
+# [^\ -~]. orjson already escapes the control characters below the space
+NON_ASCII = re.compile(r"[^\x20-\x7e]")
+
+
+def escape_ascii(match):
+    # \uXXXX like the json module, a surrogate pair beyond the BMP
+    code = ord(match.group(0))
+    if code < 0x10000:
+        return f"\\u{code:04x}"
+    code -= 0x10000
+    high, low = 0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF)
+    return f"\\u{high:04x}\\u{low:04x}"
+
+
+def serialize_boolean(value):
+    # same mapping as fields.Boolean
+    if value in fields.Boolean.truthy:
+        return True
+    if value in fields.Boolean.falsy:
+        return False
+    return bool(value)
+
+
+def field_converter(field):
+    if isinstance(field, fields.DateTime) and field.format in (None, "iso"):
+        return lambda value: value.isoformat()
+    if isinstance(field, fields.Integer) and not field.as_string:
+        return int
+    if isinstance(field, fields.Boolean):
+        return serialize_boolean
+    if isinstance(field, fields.String):
+        return str
+    raise TypeError(f"{type(field).__name__} fields can not be compiled")
+
+
+def compile_schema(schema):
+    """
+    Build a function dumping one object, a model or a result row, exactly
+    like schema.dump does but without marshmallow's per call overhead.
+    Only the field types our schemas use are supported.
+    """
+    plan = [
+        (field.data_key or name, field.attribute or name, field_converter(field))
+        for name, field in schema.dump_fields.items()
+    ]
+    missing = object()
+
+    def dump(obj):
+        data = {}
+        for key, attribute, convert in plan:
+            value = getattr(obj, attribute, missing)
+            if value is missing:
+                continue
+            data[key] = None if value is None else convert(value)
+        return data
+
+    return dump
+
+
+class FastJSONEncoder(JSONEncoder):
+    """
+    Encodes with orjson when it is installed and the output would be byte
+    for byte what the json module writes: compact separators, str keys,
+    no floats in exponent form. Anything else goes to the json module.
+    Non ascii characters are escaped afterwards when ensure_ascii is on.
+    NaN and infinities, which no payload carries, would be written as null.
+    """
+
+    def encode(self, o):
+        if (
+            orjson is None
+            or self.indent is not None
+            or self.item_separator != ","
+            or self.key_separator != ":"
+        ):
+            return super().encode(o)
+
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            # dates and dataclasses go through default like before
+            data = orjson.dumps(o, default=self.default, option=option)
+        except TypeError:
+            # int keys, big ints, lone surrogates, deep nesting
+            return super().encode(o)
+        masked = data.translate(DIGITS)
+        if b"0e" in masked or b"0.0000" in masked:
+            return super().encode(o)
+        text = data.decode("utf-8")
+        # DEL is ascii but escaped all the same
+        if self.ensure_ascii and (not text.isascii() or "\x7f" in text):
+            # JSON punctuation is ascii, so only string contents are escaped
+            text = NON_ASCII.sub(escape_ascii, text)
+        return text
@@ -0,0 +1,142 @@
+# src/slow_queries.py
+import datetime
+import os
+import threading
+import time
+import traceback
+from collections import deque
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+# frames under src that are not the caller of a query
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+SKIP_FILES = (os.path.abspath(__file__),)
+# statement prefixes the databases can explain
+EXPLAIN = {"sqlite": "EXPLAIN QUERY PLAN ", "mysql": "EXPLAIN "}
+
+
+def redact(value):
+    # keep numbers and dates for spotting bad plans, hide user content
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return f"<{type(value).__name__}>"
+
+
+def redact_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    return redact(parameters)
+
+
+def call_site():
+    # innermost frame of our own code that is not this module
+    for frame in reversed(traceback.extract_stack()):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(SRC_DIR) and path not in SKIP_FILES:
+            return f"{os.path.relpath(path, SRC_DIR)}:{frame.lineno} in {frame.name}"
+    return None
+
+
+class SlowQueryLog(object):
+    """
+    Logs SQL statements slower than SLOW_QUERY_MS with the endpoint and
+    line of code that ran them and their redacted parameters. With
+    SLOW_QUERY_EXPLAIN the database's plan for slow selects is captured
+    too, at the cost of running the explain on the request's connection.
+    """
+
+    def __init__(self):
+        self.threshold = 0
+        self.explain = False
+        self.logger = None
+        self._entries = deque(maxlen=100)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.threshold = app.config.get("SLOW_QUERY_MS", 0) / 1000
+        self.explain = app.config.get("SLOW_QUERY_EXPLAIN", False)
+        self._entries = deque(maxlen=app.config.get("SLOW_QUERY_LOG_SIZE", 100))
+        self.logger = app.logger
+        if not self.threshold:
+            return
+
+        with app.app_context():
+            binds = [None] + list(app.config.get("SQLALCHEMY_BINDS") or ())
+            for bind in binds:
+                engine = db.get_engine(app, bind=bind)
+                event.listen(engine, "before_cursor_execute", self.before_execute)
+                event.listen(engine, "after_cursor_execute", self.after_execute)
+
+    def before_execute(self, conn, cursor, statement, parameters, context, many):
+        conn.info["slow_query_started"] = time.perf_counter()
+
+    def after_execute(self, conn, cursor, statement, parameters, context, many):
+        started = conn.info.pop("slow_query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold:
+            return
+
+        rows = len(parameters) if many else 1
+        entry = {
+            "ms": round(elapsed * 1000, 3),
+            "statement": statement,
+            # the first row of an executemany
+            "parameters": redact_parameters(parameters[0] if many else parameters),
+            "rows": rows,
+            "endpoint": request.endpoint if has_request_context() else None,
+            "call_site": call_site(),
+            "plan": None,
+        }
+        if self.explain and not many:
+            entry["plan"] = self.plan(conn, statement, parameters)
+        with self._lock:
+            self._entries.append(entry)
+
+        self.logger.warning(
+            "Slow query %.1f ms at %s (%s): %s %s",
+            entry["ms"],
+            entry["call_site"],
+            entry["endpoint"] or "no request",
+            " ".join(statement.split()),
+            entry["parameters"],
+        )
+        if entry["plan"]:
+            self.logger.warning(
+                "Query plan:\n%s", "\n".join(str(row) for row in entry["plan"])
+            )
+
+    def plan(self, conn, statement, parameters):
+        prefix = EXPLAIN.get(conn.dialect.name)
+        if prefix is None or not statement.lstrip().upper().startswith("SELECT"):
+            return None
+        # a separate cursor, the statement's results are still to be fetched
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            return [f"explain failed: {e}"]
+        finally:
+            cursor.close()
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog()
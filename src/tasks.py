@@ -0,0 +1,106 @@
+# src/tasks.py
+import datetime
+import threading
+from flask import current_app
+from models import db
+from models.BlackListTokensModel import BlackListTokensModel
+from models.UserModel import UserModel
+from models.PostModel import PostModel, ReplyModel
+from cache import handle_index
+from search import search_index
+from votes import vote_buffer
+
+
+class PeriodicTask(threading.Thread):
+    """
+    Daemon thread running a job inside the app context every `interval` seconds
+    """
+
+    def __init__(self, app, name, interval, job):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self.job = job
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.job()
+                except Exception as e:
+                    print(f"Error in {self.name}: ", e)
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def sweep_blacklist():
+    # blacklisted tokens are worthless once expired, so keep them
+    # for one token lifetime after they were blacklisted
+    config = current_app.config
+    retention = datetime.timedelta(minutes=config["JWT_EXPIRY_MINUTES"])
+    return BlackListTokensModel.delete_old_records(
+        retention, config.get("BLACKLIST_SWEEP_BATCH_SIZE", 1000)
+    )
+
+
+def refresh_handle_index():
+    # picks up handles registered or changed through other workers
+    handle_index.load(UserModel.get_handles())
+
+
+def refresh_search_index():
+    # rebuilt from scratch, deletes cascaded from users and posts included
+    search_index.load(PostModel.query.yield_per(1000), ReplyModel.query.yield_per(1000))
+
+
+def decay_hot_scores():
+    # older posts keep the score they had when they left the window
+    config = current_app.config
+    since = datetime.datetime.utcnow() - datetime.timedelta(
+        days=config.get("HOT_SCORE_WINDOW_DAYS", 7)
+    )
+    return PostModel.decay_hot_scores(since)
+
+
+def start_background_tasks(app):
+    tasks = []
+
+    # build the in memory indexes before serving
+    indexes = [
+        ("handle index", refresh_handle_index, "HANDLE_INDEX_REFRESH_INTERVAL"),
+        ("search index", refresh_search_index, "SEARCH_INDEX_REFRESH_INTERVAL"),
+    ]
+    for name, refresh, setting in indexes:
+        with app.app_context():
+            try:
+                refresh()
+            except Exception as e:
+                print(f"Error loading the {name}: ", e)
+            finally:
+                db.session.remove()
+        interval = app.config.get(setting, 0)
+        if interval:
+            task_name = name.replace(" ", "-") + "-refresh"
+            tasks.append(PeriodicTask(app, task_name, interval, refresh))
+
+    interval = app.config.get("BLACKLIST_SWEEP_INTERVAL", 0)
+    if interval:
+        tasks.append(PeriodicTask(app, "blacklist-sweeper", interval, sweep_blacklist))
+
+    interval = app.config.get("HOT_SCORE_DECAY_INTERVAL", 0)
+    if interval:
+        tasks.append(PeriodicTask(app, "hot-score-decay", interval, decay_hot_scores))
+
+    interval = app.config.get("VOTE_BUFFER_INTERVAL", 0)
+    if interval:
+        tasks.append(
+            PeriodicTask(app, "vote-buffer-flush", interval, vote_buffer.flush)
+        )
+
+    for task in tasks:
+        task.start()
+    return tasks
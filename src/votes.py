@@ -0,0 +1,203 @@
+# src/votes.py
+import atexit
+import datetime
+import threading
+
+from models import db
+
+
+class VoteBuffer(object):
+    """
+    Optional write behind buffer for post and comment votes.
+
+    Toggles are collapsed per (kind, target, user) in memory and written to
+    the vote tables in bulk every VOTE_BUFFER_INTERVAL seconds, or as soon
+    as VOTE_BUFFER_MAX_PENDING votes are waiting. Reads add the buffered
+    deltas on top of the database, so a crash loses at most one window.
+    """
+
+    KINDS = ("post", "comment")
+
+    def __init__(self):
+        self.enabled = False
+        self.max_pending = 0
+        self.version = 0  # bumped by every buffered toggle
+        self.changed_at = None  # utc time of the last buffered toggle
+        self.flushes = 0
+        self._pending = VoteBuffer.empty()
+        # the votes being written, still visible to reads until committed
+        self._flushing = VoteBuffer.empty()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    @staticmethod
+    def empty():
+        # (kind, target id) -> {user id: [voted in the database, voted now]},
+        # plus post id -> toggles since the last flush, for ETags
+        return {"votes": {}, "posts": {}}
+
+    def init_app(self, app):
+        interval = app.config.get("VOTE_BUFFER_INTERVAL", 0)
+        self.enabled = bool(interval)
+        self.max_pending = app.config.get("VOTE_BUFFER_MAX_PENDING", 1000)
+        if self.enabled:
+            # best effort on a clean shutdown, a crash loses the window
+            atexit.register(self.flush_app, app)
+
+    def toggle(self, kind, target_id, user_id, post_id, voted):
+        """
+        Buffer a vote toggle. `voted` is called for the database state when
+        the vote is not buffered yet. Returns True when the user now votes.
+        """
+        with self._lock:
+            entry = self._entry(kind, target_id, user_id)
+        if entry is None:
+            # outside the lock, another toggle may race us to the database
+            state = bool(voted())
+            with self._lock:
+                entry = self._entry(kind, target_id, user_id)
+                if entry is None:
+                    users = self._pending["votes"].setdefault((kind, target_id), {})
+                    entry = users[user_id] = [state, state]
+
+        with self._lock:
+            entry[1] = not entry[1]
+            posts = self._pending["posts"]
+            posts[post_id] = posts.get(post_id, 0) + 1
+            self.version += 1
+            self.changed_at = datetime.datetime.utcnow()
+            full = self.pending() >= self.max_pending
+            voted_now = entry[1]
+
+        if full:
+            try:
+                self.flush()
+            except Exception as e:
+                # the votes stay buffered for the next flush
+                print("Error flushing the vote buffer: ", e)
+        return voted_now
+
+    def pending(self):
+        return sum(len(users) for users in self._pending["votes"].values())
+
+    def delta(self, kind, target_id):
+        # change to the stored vote count of a target
+        if not self.enabled:
+            return 0
+        total = 0
+        with self._lock:
+            for buffer in (self._flushing, self._pending):
+                for before, now in buffer["votes"].get((kind, target_id), {}).values():
+                    total += int(now) - int(before)
+        return total
+
+    def apply_likes(self, kind, likes, target_ids):
+        # add and remove buffered voters in a target id -> [user id] mapping
+        if not self.enabled:
+            return likes
+        with self._lock:
+            for target_id in target_ids:
+                for buffer in (self._flushing, self._pending):
+                    votes = buffer["votes"].get((kind, target_id), {})
+                    for user_id, (before, now) in votes.items():
+                        voters = likes.setdefault(target_id, [])
+                        if now and user_id not in voters:
+                            voters.append(user_id)
+                        elif not now and user_id in voters:
+                            voters.remove(user_id)
+        return likes
+
+    def generation(self, post_id):
+        # toggles on a post and its comments since the last flush
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return self._pending["posts"].get(post_id, 0) + self._flushing["posts"].get(
+                post_id, 0
+            )
+
+    def flush_app(self, app):
+        with app.app_context():
+            try:
+                self.flush()
+            finally:
+                db.session.remove()
+
+    def flush(self):
+        """
+        Write the buffered votes in one transaction, returns how many
+        """
+        # imported here to avoid a circular import with the models
+        from models.UpvoteModel import UpvoteModel, CommentUpvoteModel
+
+        # one flush at a time, a concurrent caller leaves it to the running one
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                self._flushing, self._pending = self._pending, VoteBuffer.empty()
+
+            changes = {kind: ([], []) for kind in VoteBuffer.KINDS}
+            for (kind, target_id), users in self._flushing["votes"].items():
+                for user_id, (before, now) in users.items():
+                    if before != now:
+                        changes[kind][int(now)].append((target_id, user_id))
+
+            written = 0
+            models = {"post": UpvoteModel, "comment": CommentUpvoteModel}
+            try:
+                for kind, (removes, adds) in changes.items():
+                    written += models[kind].apply_votes(adds, removes)
+                # reads must not count the votes both in the tables and here
+                with self._lock:
+                    db.session.commit()
+                    self._flushing = VoteBuffer.empty()
+            except Exception:
+                db.session.rollback()
+                # keep the votes for the next flush
+                with self._lock:
+                    self._merge(self._flushing)
+                raise
+            self.flushes += 1
+            return written
+        finally:
+            with self._lock:
+                self._flushing = VoteBuffer.empty()
+            self._flush_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending": self.pending(),
+                "max_pending": self.max_pending,
+                "flushes": self.flushes,
+            }
+
+    def _entry(self, kind, target_id, user_id):
+        # the buffered vote, or one made from the flush in progress
+        entry = self._pending["votes"].get((kind, target_id), {}).get(user_id)
+        if entry is None:
+            flushing = self._flushing["votes"].get((kind, target_id), {})
+            if user_id in flushing:
+                state = flushing[user_id][1]
+                users = self._pending["votes"].setdefault((kind, target_id), {})
+                entry = users[user_id] = [state, state]
+        return entry
+
+    def _merge(self, failed):
+        # put a failed flush back under the toggles made since
+        for key, users in failed["votes"].items():
+            pending = self._pending["votes"].setdefault(key, {})
+            for user_id, (before, now) in users.items():
+                if user_id in pending:
+                    pending[user_id][0] = before
+                else:
+                    pending[user_id] = [before, now]
+        for post_id, count in failed["posts"].items():
+            self._pending["posts"][post_id] = (
+                self._pending["posts"].get(post_id, 0) + count
+            )
+
+
+vote_buffer = VoteBuffer()